@@ -1,4 +1,6 @@
+import io
 import os
+import sys
 from dotenv import load_dotenv
 
 import discord
@@ -8,12 +10,18 @@ from nacl.public import PrivateKey, PublicKey, SealedBox
 
 # Load variables from .env file
 load_dotenv()
+# Modules shared with StegBot live in ../shared
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from key_store import KeyStore
+from file_stream import DISCORD_UPLOAD_LIMIT, decrypt_stream, encrypt_stream, encrypted_size, iter_attachment
+from shared.admission import admission_controlled
+from shared.transport import MESSAGE_FILENAME, open_packed, seal
 
 TOKEN = os.getenv("DISCORD_TOKEN_CC")
 
-# This is a demo storage for user keys:
-# In real life you'd store this securely in a DB
-user_keys = {}
+# Keypairs by user ID, kept in memory and persisted to an append-only log (see key_store.py)
+user_keys = KeyStore()
 
 intents = discord.Intents.default()
 bot = commands.Bot(command_prefix="!", intents=intents)
@@ -34,10 +42,7 @@ async def on_ready():
 async def generate_keys(interaction: discord.Interaction):
     private_key = PrivateKey.generate()
     public_key = private_key.public_key
-    user_keys[interaction.user.id] = {
-        "private_key": private_key.encode().hex(),
-        "public_key": public_key.encode().hex()
-    }
+    await user_keys.put(interaction.user.id, public_key.encode().hex(), private_key.encode().hex())
     await interaction.response.send_message(
         f"✅ Your keypair has been generated!\nPublic Key:\n`{public_key.encode().hex()}`",
         ephemeral=True
@@ -60,16 +65,23 @@ async def encrypt(interaction: discord.Interaction, to_user: discord.User):
         message = discord.ui.TextInput(label="Message", style=discord.TextStyle.paragraph)
 
         async def on_submit(self, modal_interaction: discord.Interaction):
-            # Encrypt the message from modal
+            # Compress and encrypt the message from modal
             pub_key_hex = user_keys[to_user.id]["public_key"]
             recipient_pub_key = PublicKey(bytes.fromhex(pub_key_hex))
             sealed_box = SealedBox(recipient_pub_key)
-            encrypted = sealed_box.encrypt(self.message.value.encode())
+            packed = seal(self.message.value.encode(), sealed_box.encrypt)
 
             try:
-                await to_user.send(
-                    f"🔒 Encrypted message from {interaction.user.mention}:\n```\n{encrypted.hex()}\n```"
-                )
+                # Too long for one message -> sent as a file
+                if packed.fits_inline():
+                    await to_user.send(
+                        f"🔒 Encrypted message from {interaction.user.mention}:\n```\n{packed.text()}\n```"
+                    )
+                else:
+                    await to_user.send(
+                        f"🔒 Encrypted message from {interaction.user.mention} (attached; run /decrypt with the file).",
+                        file=discord.File(io.BytesIO(packed.file_bytes()), filename=MESSAGE_FILENAME)
+                    )
                 await modal_interaction.response.send_message(
                     f"✅ Encrypted message delivered to {to_user.mention}'s DMs.",
                     ephemeral=True
@@ -84,28 +96,48 @@ async def encrypt(interaction: discord.Interaction, to_user: discord.User):
 
 # Command: /decrypt
 @bot.tree.command(name="decrypt", description="Decrypt an encrypted message.")
-@app_commands.describe(ciphertext="Encrypted message in hex")
-async def decrypt(interaction: discord.Interaction, ciphertext: str):
+@app_commands.describe(
+    ciphertext="Encrypted message as it was sent (older hex messages work too)",
+    attachment="The encrypted message file, for messages too long to send as text"
+)
+async def decrypt(interaction: discord.Interaction, ciphertext: str | None = None, attachment: discord.Attachment | None = None):
+    await interaction.response.defer(thinking=True, ephemeral=True)
+
     if interaction.user.id not in user_keys:
-        await interaction.response.send_message(
+        await interaction.followup.send(
             "❌ You don't have a keypair. Run /generate_keys first.",
             ephemeral=True
         )
         return
 
+    if ciphertext is None and attachment is None:
+        await interaction.followup.send("❌ Paste the encrypted message or attach its file.", ephemeral=True)
+        return
+    if attachment is not None and attachment.size > DISCORD_UPLOAD_LIMIT:
+        await interaction.followup.send("❌ That file is too large to be an encrypted message.", ephemeral=True)
+        return
+
     priv_key_hex = user_keys[interaction.user.id]["private_key"]
     private_key = PrivateKey(bytes.fromhex(priv_key_hex))
 
     sealed_box = SealedBox(private_key)
     try:
-        decrypted = sealed_box.decrypt(bytes.fromhex(ciphertext))
-        plaintext = decrypted.decode()
-        await interaction.response.send_message(
-            f"✅ Decrypted message:\n```\n{plaintext}\n```",
-            ephemeral=True
-        )
+        # Armored text, an attached message file, or hex from older messages
+        data = await attachment.read() if attachment is not None else ciphertext
+        plaintext = open_packed(data, sealed_box.decrypt).decode()
+        if len(plaintext) > 1900:
+            await interaction.followup.send(
+                "✅ Decrypted message (attached, too long to show):",
+                file=discord.File(io.BytesIO(plaintext.encode()), filename="message.txt"),
+                ephemeral=True
+            )
+        else:
+            await interaction.followup.send(
+                f"✅ Decrypted message:\n```\n{plaintext}\n```",
+                ephemeral=True
+            )
     except Exception as e:
-        await interaction.response.send_message(
+        await interaction.followup.send(
             f"❌ Failed to decrypt: {str(e)}",
             ephemeral=True
         )
@@ -113,9 +145,8 @@ async def decrypt(interaction: discord.Interaction, ciphertext: str):
 # Command: /encrypt_file
 @bot.tree.command(name="encrypt_file", description="Encrypt a file for another user.")
 @app_commands.describe(to_user="User to encrypt file for")
+@admission_controlled
 async def encrypt_file(interaction: discord.Interaction, to_user: discord.User, attachment: discord.Attachment):
-    await interaction.response.defer(thinking=True, ephemeral=True)
-
     if to_user.id not in user_keys:
         await interaction.followup.send(
             "❌ That user has not generated keys yet. Ask them to run /generate_keys.",
@@ -123,22 +154,26 @@ async def encrypt_file(interaction: discord.Interaction, to_user: discord.User,
         )
         return
 
-    # Download the uploaded file
-    file_bytes = await attachment.read()
+    if encrypted_size(attachment.size) > DISCORD_UPLOAD_LIMIT:
+        await interaction.followup.send(
+            f"❌ That file is too large to send back encrypted (limit {DISCORD_UPLOAD_LIMIT / 1024 / 1024:.0f} MiB).",
+            ephemeral=True
+        )
+        return
 
-    # Encrypt the file
+    # Encrypt the file chunk by chunk as it downloads, straight into the upload buffer
     pub_key_hex = user_keys[to_user.id]["public_key"]
-    recipient_pub_key = PublicKey(bytes.fromhex(pub_key_hex))
-    sealed_box = SealedBox(recipient_pub_key)
-    encrypted_bytes = sealed_box.encrypt(file_bytes)
-
-    # Save to a temporary file
-    enc_filename = f"encrypted_{attachment.filename}.bin"
-    with open(enc_filename, "wb") as f:
-        f.write(encrypted_bytes)
+    encrypted = io.BytesIO()
+    try:
+        await encrypt_stream(iter_attachment(attachment), bytes.fromhex(pub_key_hex), encrypted)
+    except Exception as e:
+        await interaction.followup.send(f"❌ Failed to encrypt file: {str(e)}", ephemeral=True)
+        return
+    encrypted.seek(0)
 
     # Send the encrypted file as an attachment
-    file_to_send = discord.File(enc_filename, filename=enc_filename)
+    enc_filename = f"encrypted_{attachment.filename}.bin"
+    file_to_send = discord.File(encrypted, filename=enc_filename)
 
     try:
         await to_user.send(
@@ -155,15 +190,11 @@ async def encrypt_file(interaction: discord.Interaction, to_user: discord.User,
             ephemeral=True
         )
 
-    # Clean up temp file
-    os.remove(enc_filename)
-
 
 # Command: /decrypt_file
 @bot.tree.command(name="decrypt_file", description="Decrypt an encrypted file sent to you.")
+@admission_controlled
 async def decrypt_file(interaction: discord.Interaction, attachment: discord.Attachment):
-    await interaction.response.defer(thinking=True, ephemeral=True)
-
     if interaction.user.id not in user_keys:
         await interaction.followup.send(
             "❌ You don't have a keypair. Run /generate_keys first.",
@@ -171,15 +202,20 @@ async def decrypt_file(interaction: discord.Interaction, attachment: discord.Att
         )
         return
 
-    # Download the encrypted file
-    encrypted_bytes = await attachment.read()
+    if attachment.size > encrypted_size(DISCORD_UPLOAD_LIMIT):
+        await interaction.followup.send(
+            f"❌ That file is too large to send back decrypted (limit {DISCORD_UPLOAD_LIMIT / 1024 / 1024:.0f} MiB).",
+            ephemeral=True
+        )
+        return
 
     priv_key_hex = user_keys[interaction.user.id]["private_key"]
     private_key = PrivateKey(bytes.fromhex(priv_key_hex))
-    sealed_box = SealedBox(private_key)
 
+    # Decrypt the file chunk by chunk as it downloads
+    decrypted = io.BytesIO()
     try:
-        decrypted_bytes = sealed_box.decrypt(encrypted_bytes)
+        await decrypt_stream(iter_attachment(attachment), private_key, decrypted)
     except Exception as e:
         await interaction.followup.send(
             f"❌ Failed to decrypt file: {str(e)}",
@@ -187,13 +223,10 @@ async def decrypt_file(interaction: discord.Interaction, attachment: discord.Att
         )
         return
 
-    # Write decrypted file
-    decrypted_filename = attachment.filename.replace("encrypted_", "").replace(".bin", "")
-    with open(decrypted_filename, "wb") as f:
-        f.write(decrypted_bytes)
-
     # Send back the decrypted file privately
-    decrypted_file = discord.File(decrypted_filename, filename=decrypted_filename)
+    decrypted.seek(0)
+    decrypted_filename = attachment.filename.replace("encrypted_", "").replace(".bin", "")
+    decrypted_file = discord.File(decrypted, filename=decrypted_filename)
 
     await interaction.followup.send(
         f"✅ File decrypted successfully!",
@@ -201,9 +234,10 @@ async def decrypt_file(interaction: discord.Interaction, attachment: discord.Att
         ephemeral=True
     )
 
-    # Clean up temp file
-    os.remove(decrypted_filename)
-
 
 if __name__ == "__main__":
-    bot.run(TOKEN)
+    user_keys.load()
+    try:
+        bot.run(TOKEN)
+    finally:
+        user_keys.close()
@@ -0,0 +1,212 @@
+import os
+import struct
+
+import aiohttp
+from dotenv import load_dotenv
+from nacl.bindings import (
+    crypto_secretstream_xchacha20poly1305_ABYTES as ABYTES,
+    crypto_secretstream_xchacha20poly1305_HEADERBYTES as STREAM_HEADER_SIZE,
+    crypto_secretstream_xchacha20poly1305_KEYBYTES as KEY_SIZE,
+    crypto_secretstream_xchacha20poly1305_TAG_FINAL as TAG_FINAL,
+    crypto_secretstream_xchacha20poly1305_TAG_MESSAGE as TAG_MESSAGE,
+    crypto_secretstream_xchacha20poly1305_init_pull,
+    crypto_secretstream_xchacha20poly1305_init_push,
+    crypto_secretstream_xchacha20poly1305_keygen,
+    crypto_secretstream_xchacha20poly1305_pull,
+    crypto_secretstream_xchacha20poly1305_push,
+    crypto_secretstream_xchacha20poly1305_state,
+)
+from nacl.exceptions import CryptoError
+from nacl.public import PrivateKey, PublicKey, SealedBox
+from nacl.secret import SecretBox
+
+from shared.transport import open_packed
+
+load_dotenv()
+
+# Plaintext bytes per encrypted chunk; files record their own, so changing it doesn't break old ones
+FILE_CHUNK_SIZE = int(os.getenv("FILE_CHUNK_SIZE", str(64 * 1024)))
+# Largest file the bot will try to upload (Discord's default attachment limit is 10 MiB)
+DISCORD_UPLOAD_LIMIT = int(os.getenv("DISCORD_UPLOAD_LIMIT", str(10 * 1024 * 1024)))
+
+# Encrypted file layout:
+#
+#   "CCF" | version (1 byte) | chunk size (4 bytes) | sealed file key | secretstream header | chunks
+#
+# The file key is random per file and sealed to the recipient. Each chunk is
+# one secretstream message of `chunk size` plaintext bytes (the last may be
+# shorter) and only the last is tagged FINAL, so truncated, reordered or
+# spliced files fail to decrypt.
+FILE_MAGIC = b"CCF"
+FILE_VERSION = 1
+_FILE_HEADER = struct.Struct(">3sBI")
+# A SealedBox adds an ephemeral public key and a MAC to what it seals
+SEALED_BOX_OVERHEAD = PublicKey.SIZE + SecretBox.MACBYTES
+SEALED_KEY_SIZE = PublicKey.SIZE + SecretBox.MACBYTES + KEY_SIZE
+HEADER_SIZE = _FILE_HEADER.size + SEALED_KEY_SIZE + STREAM_HEADER_SIZE
+
+
+def encrypted_size(size: int, chunk_size: int = FILE_CHUNK_SIZE) -> int:
+    """
+    Size of the encrypted file for a `size`-byte plaintext.
+    """
+    chunks = max(1, -(-size // chunk_size))
+    return HEADER_SIZE + size + chunks * ABYTES
+
+
+def is_stream_file(data: bytes) -> bool:
+    return data[:len(FILE_MAGIC)] == FILE_MAGIC and len(data) > len(FILE_MAGIC) and data[len(FILE_MAGIC)] == FILE_VERSION
+
+
+class FileEncryptor:
+    """
+    Encrypts a file for one recipient a piece at a time: feed it with
+    update() and end with finalize(). Holds at most one chunk of plaintext.
+    """
+
+    def __init__(self, public_key: bytes, chunk_size: int = FILE_CHUNK_SIZE):
+        key = crypto_secretstream_xchacha20poly1305_keygen()
+        self.chunk_size = chunk_size
+        self._state = crypto_secretstream_xchacha20poly1305_state()
+        stream_header = crypto_secretstream_xchacha20poly1305_init_push(self._state, key)
+        self._header = (_FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, chunk_size)
+                        + SealedBox(PublicKey(public_key)).encrypt(key) + stream_header)
+        self._pending = bytearray()
+
+    def update(self, data: bytes) -> bytes:
+        out = [self._header]
+        self._header = b""
+        self._pending += data
+        # Keep the last (possibly full) chunk back: it has to be tagged FINAL
+        start = 0
+        while len(self._pending) - start > self.chunk_size:
+            out.append(crypto_secretstream_xchacha20poly1305_push(
+                self._state, bytes(self._pending[start:start + self.chunk_size]), tag=TAG_MESSAGE
+            ))
+            start += self.chunk_size
+        del self._pending[:start]
+        return b"".join(out)
+
+    def finalize(self) -> bytes:
+        last = crypto_secretstream_xchacha20poly1305_push(self._state, bytes(self._pending), tag=TAG_FINAL)
+        self._pending.clear()
+        return self._header + last
+
+
+class FileDecryptor:
+    """
+    The reverse of FileEncryptor. Raises CryptoError if the file wasn't
+    encrypted for `private_key` or was tampered with or cut short.
+    """
+
+    def __init__(self, private_key: PrivateKey):
+        self.private_key = private_key
+        self._state = None
+        self._chunk_bytes = 0
+        self._pending = bytearray()
+        self._finished = False
+
+    def _start(self):
+        _, _, chunk_size = _FILE_HEADER.unpack_from(self._pending)
+        if not chunk_size:
+            raise CryptoError("The encrypted file's header is invalid.")
+        sealed_key = bytes(self._pending[_FILE_HEADER.size:_FILE_HEADER.size + SEALED_KEY_SIZE])
+        stream_header = bytes(self._pending[_FILE_HEADER.size + SEALED_KEY_SIZE:HEADER_SIZE])
+        key = SealedBox(self.private_key).decrypt(sealed_key)
+        self._state = crypto_secretstream_xchacha20poly1305_state()
+        crypto_secretstream_xchacha20poly1305_init_pull(self._state, stream_header, key)
+        self._chunk_bytes = chunk_size + ABYTES
+        del self._pending[:HEADER_SIZE]
+
+    def _pull(self, chunk: bytes) -> bytes:
+        if self._finished:
+            raise CryptoError("Unexpected data after the end of the file.")
+        try:
+            message, tag = crypto_secretstream_xchacha20poly1305_pull(self._state, chunk)
+        except RuntimeError:
+            # libsodium only reports a failed pull as an unexpected failure
+            raise CryptoError("The encrypted file is corrupted or was tampered with.") from None
+        self._finished = tag == TAG_FINAL
+        return message
+
+    def update(self, data: bytes) -> bytes:
+        self._pending += data
+        if self._state is None:
+            if len(self._pending) < HEADER_SIZE:
+                return b""
+            self._start()
+
+        out = []
+        start = 0
+        # As when encrypting, the last chunk waits for finalize()
+        while len(self._pending) - start > self._chunk_bytes:
+            out.append(self._pull(bytes(self._pending[start:start + self._chunk_bytes])))
+            start += self._chunk_bytes
+        del self._pending[:start]
+        return b"".join(out)
+
+    def finalize(self) -> bytes:
+        if self._state is None or not self._pending:
+            raise CryptoError("The encrypted file is incomplete.")
+        last = self._pull(bytes(self._pending))
+        self._pending.clear()
+        if not self._finished:
+            raise CryptoError("The encrypted file is incomplete.")
+        return last
+
+
+async def iter_attachment(attachment, chunk_size: int = FILE_CHUNK_SIZE):
+    """
+    Yields an attachment's bytes as they download, instead of reading it
+    into memory whole like Attachment.read().
+    """
+    async with aiohttp.ClientSession() as session:
+        async with session.get(attachment.url) as response:
+            response.raise_for_status()
+            async for data in response.content.iter_chunked(chunk_size):
+                yield data
+
+
+async def encrypt_stream(chunks, public_key: bytes, out) -> int:
+    """
+    Encrypts the async iterable of byte strings `chunks` for `public_key`
+    into the binary file `out`. Returns the number of bytes written.
+    """
+    encryptor = FileEncryptor(public_key)
+    written = 0
+    async for data in chunks:
+        written += out.write(encryptor.update(data))
+    return written + out.write(encryptor.finalize())
+
+
+async def decrypt_stream(chunks, private_key: PrivateKey, out) -> int:
+    """
+    Decrypts an encrypted file arriving as `chunks` into `out`. Files from
+    before the streaming format (a single SealedBox) are still accepted, as
+    are encrypted messages sent as files or pasted into one.
+    Returns the number of bytes written.
+    """
+    chunks = aiter(chunks)
+    head = bytearray()
+    async for data in chunks:
+        head += data
+        if len(head) > len(FILE_MAGIC):
+            break
+
+    if not is_stream_file(head):
+        async for data in chunks:
+            head += data
+
+        def open_sealed(ciphertext: bytes) -> bytes:
+            # SealedBox rejects short input with a TypeError that means nothing to the user
+            if len(ciphertext) < SEALED_BOX_OVERHEAD:
+                raise CryptoError("That isn't an encrypted file.")
+            return SealedBox(private_key).decrypt(ciphertext)
+
+        return out.write(open_packed(bytes(head), open_sealed))
+
+    decryptor = FileDecryptor(private_key)
+    written = out.write(decryptor.update(bytes(head)))
+    async for data in chunks:
+        written += out.write(decryptor.update(data))
+    return written + out.write(decryptor.finalize())
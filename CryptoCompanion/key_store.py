@@ -0,0 +1,217 @@
+import asyncio
+import os
+import struct
+import time
+import zlib
+
+from dotenv import load_dotenv
+from nacl.exceptions import CryptoError
+from nacl.secret import SecretBox
+
+load_dotenv()
+
+# Append-only log of keypairs, replayed into memory at startup
+KEY_STORE_PATH = os.getenv("KEY_STORE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cryptocompanion_keys.log"))
+# 32 bytes as hex; private keys are encrypted with it on disk. Required unless KEY_STORE_MEMORY_ONLY is set
+KEY_STORE_SECRET = os.getenv("KEY_STORE_SECRET")
+# Keep keys in memory only (lost on restart) instead of refusing to start without a secret
+KEY_STORE_MEMORY_ONLY = os.getenv("KEY_STORE_MEMORY_ONLY", "").lower() in ("1", "true", "yes")
+# Extra seconds an fsync waits for more writes to join it (writes made while one runs always share the next)
+KEY_STORE_FSYNC_INTERVAL = float(os.getenv("KEY_STORE_FSYNC_INTERVAL", "0"))
+
+# File layout: "CCKS" | version (1 byte), then fixed-size records
+#
+#   user_id (8 bytes) | public key (32) | SecretBox-encrypted private key (72) | CRC32 of the rest (4)
+#
+# A later record for the same user replaces the earlier one. Fixed-size
+# records load with one read and struct.iter_unpack, and a torn final write
+# is detected by its length or CRC and cut off.
+LOG_MAGIC = b"CCKS"
+LOG_VERSION = 1
+_LOG_HEADER = LOG_MAGIC + bytes([LOG_VERSION])
+_RECORD = struct.Struct(">Q32s72sI")
+
+# Rewrite the log at startup once it's mostly superseded records
+COMPACT_MIN_RECORDS = 1000
+
+
+class KeyStore:
+    """
+    Keypairs by user ID: a dict in memory backed by an append-only log.
+
+    `user_id in store` and `store[user_id]` (a {"public_key", "private_key"}
+    dict of hex strings) read from memory. `await store.put()` appends a
+    record and returns once it's fsynced; concurrent puts share one fsync.
+    """
+
+    def __init__(self, path: str | None = KEY_STORE_PATH, secret: str | None = KEY_STORE_SECRET,
+                 fsync_interval: float = KEY_STORE_FSYNC_INTERVAL, memory_only: bool = KEY_STORE_MEMORY_ONLY):
+        self.path = None if memory_only else path
+        self.secret = None if memory_only else secret
+        self._box = None
+        self.fsync_interval = fsync_interval
+        self._index = {}  # user_id -> (public key, sealed private key)
+        self._fd = None
+        self._written = self._synced = 0  # appended records / how many of them are known to be on disk
+        self._syncing = None
+        self.records = 0
+        self.load_seconds = 0.0
+        self.writes = self.fsyncs = 0
+        self.write_seconds = self.max_write_seconds = 0.0
+
+    def load(self):
+        """
+        Replays the log into memory (compacting it if worthwhile) and opens it for appending.
+        Raises RuntimeError if there's no secret or it doesn't open the keys in the log.
+        """
+        if self.path is None:
+            print("⚠️ KEY_STORE_MEMORY_ONLY is set; keys are kept in memory only and lost on restart.")
+            return
+        if not self.secret:
+            raise RuntimeError(
+                "❌ KEY_STORE_SECRET is not set. Set it to keep keys across restarts, "
+                "or set KEY_STORE_MEMORY_ONLY=true to keep them in memory only."
+            )
+        try:
+            self._box = SecretBox(bytes.fromhex(self.secret))
+        except (ValueError, TypeError):
+            raise RuntimeError("❌ KEY_STORE_SECRET must be 32 bytes written as 64 hex characters.") from None
+
+        start = time.perf_counter()
+        data = b""
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                data = f.read()
+        if data and not data.startswith(_LOG_HEADER):
+            raise RuntimeError(f"❌ {self.path} is not a CryptoCompanion key log.")
+
+        body = memoryview(data)[len(_LOG_HEADER):] if data else memoryview(b"")
+        whole = len(body) - len(body) % _RECORD.size
+        damaged = 0
+        checked = _RECORD.size - 4
+        for offset, (user_id, public_key, sealed, crc) in zip(range(0, whole, _RECORD.size), _RECORD.iter_unpack(body[:whole])):
+            if zlib.crc32(body[offset:offset + checked]) != crc:
+                damaged += 1
+                continue
+            self._index[user_id] = (public_key, sealed)
+        self.records = whole // _RECORD.size - damaged
+        self._check_secret()
+
+        if not data or (self.records >= COMPACT_MIN_RECORDS and self.records > 2 * len(self._index)):
+            self._rewrite()
+        elif whole != len(body):
+            # A write that was cut off mid-record; nothing after it can be trusted to line up
+            with open(self.path, "r+b") as f:
+                f.truncate(len(_LOG_HEADER) + whole)
+            print(f"⚠️ Dropped an incomplete record at the end of {self.path}.")
+        if damaged:
+            print(f"⚠️ Skipped {damaged} damaged record(s) in {self.path}.")
+
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        self.load_seconds = time.perf_counter() - start
+        print(f"🔑 Loaded {len(self._index)} keypairs in {self.load_seconds * 1000:.1f} ms.")
+
+    def _check_secret(self):
+        """
+        Opens one stored private key, so a wrong or rotated secret stops the
+        bot at startup instead of failing every decryption later.
+        """
+        for _, sealed in self._index.values():
+            try:
+                self._box.decrypt(sealed)
+            except CryptoError:
+                raise RuntimeError(
+                    f"❌ KEY_STORE_SECRET doesn't decrypt the keys in {self.path}; "
+                    "it isn't the secret they were stored with."
+                ) from None
+            return
+
+    def _record(self, user_id: int, public_key: bytes, sealed: bytes) -> bytes:
+        return _RECORD.pack(user_id, public_key, sealed, zlib.crc32(struct.pack(">Q", user_id) + public_key + sealed))
+
+    def _rewrite(self):
+        """
+        Writes just the live records to a new log and swaps it in atomically.
+        """
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_LOG_HEADER)
+            f.write(b"".join(self._record(uid, pub, sealed) for uid, (pub, sealed) in self._index.items()))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.records = len(self._index)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._index
+
+    def __getitem__(self, user_id: int) -> dict:
+        public_key, private_key = self._index[user_id]
+        if self._box is not None:
+            private_key = self._box.decrypt(private_key)
+        return {"public_key": public_key.hex(), "private_key": private_key.hex()}
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    async def put(self, user_id: int, public_key_hex: str, private_key_hex: str):
+        """
+        Stores a keypair, replacing any earlier one, and waits until it's on disk.
+        """
+        start = time.perf_counter()
+        public_key, private_key = bytes.fromhex(public_key_hex), bytes.fromhex(private_key_hex)
+
+        if self._fd is None:
+            self._index[user_id] = (public_key, private_key)
+            return
+
+        sealed = self._box.encrypt(private_key)
+        os.write(self._fd, self._record(user_id, public_key, sealed))
+        self._index[user_id] = (public_key, sealed)
+        self.records += 1
+        self._written += 1
+        await self._sync(self._written)
+
+        elapsed = time.perf_counter() - start
+        self.writes += 1
+        self.write_seconds += elapsed
+        self.max_write_seconds = max(self.max_write_seconds, elapsed)
+
+    async def _sync(self, written: int):
+        """
+        Waits until the first `written` records are on disk. One fsync runs at
+        a time and covers every record appended before it started, so writes
+        that arrive while it runs are batched into the next one.
+        """
+        while self._synced < written:
+            if self._syncing is None:
+                self._syncing = asyncio.ensure_future(self._fsync())
+            await asyncio.shield(self._syncing)
+
+    async def _fsync(self):
+        try:
+            if self.fsync_interval:
+                await asyncio.sleep(self.fsync_interval)
+            covered = self._written
+            await asyncio.to_thread(os.fsync, self._fd)
+            self._synced = max(self._synced, covered)
+            self.fsyncs += 1
+        finally:
+            self._syncing = None
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._index),
+            "records": self.records,
+            "load_ms": round(self.load_seconds * 1000, 1),
+            "writes": self.writes,
+            "fsyncs": self.fsyncs,
+            "avg_write_ms": round(self.write_seconds / self.writes * 1000, 2) if self.writes else 0.0,
+            "max_write_ms": round(self.max_write_seconds * 1000, 2),
+        }
+
+    def close(self):
+        if self._fd is not None:
+            os.fsync(self._fd)
+            os.close(self._fd)
+            self._fd = None
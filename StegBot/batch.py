@@ -0,0 +1,145 @@
+import asyncio
+import os
+import re
+from typing import NamedTuple
+
+from dotenv import load_dotenv
+
+from image_encoder import DISCORD_UPLOAD_LIMIT
+from ingest import IngestError
+from worker_pool import STEG_WORKERS
+
+load_dotenv()
+
+# Most images one batch command will take
+STEG_BATCH_MAX_IMAGES = int(os.getenv("STEG_BATCH_MAX_IMAGES", "10"))
+# Images processed at once across all running batches (defaults to the worker count)
+STEG_BATCH_CONCURRENCY = int(os.getenv("STEG_BATCH_CONCURRENCY") or STEG_WORKERS)
+
+# Discord allows at most 10 attachments per message
+MAX_FILES_PER_MESSAGE = 10
+
+MESSAGE_LINK = re.compile(r"(?:https?://(?:\w+\.)?discord(?:app)?\.com/channels/\d+/(\d+)/)?(\d+)/?$")
+
+# Shared by every batch, so one big album can't starve the menus and other batches
+_batch_slots = asyncio.Semaphore(STEG_BATCH_CONCURRENCY)
+
+
+class BatchResult(NamedTuple):
+    name: str                # attachment filename, made unique within the batch
+    data: bytes | None       # processed file, or None if it failed
+    error: str | None = None
+
+
+def is_image(attachment) -> bool:
+    return bool(attachment.content_type and attachment.content_type.startswith("image/"))
+
+
+async def collect_images(interaction, attachments: list, message_link: str | None = None) -> list:
+    """
+    The image attachments passed to a batch command plus, if `message_link`
+    (a message link or ID) is given, every image attached to that message.
+    The message must be in the channel the command was used in.
+    Raises IngestError if there is nothing to process or too much.
+    """
+    images = [a for a in attachments if a is not None]
+
+    if message_link:
+        match = MESSAGE_LINK.match(message_link.strip())
+        if not match or (match.group(1) and int(match.group(1)) != interaction.channel_id):
+            raise IngestError("❌ That isn't a link to a message in this channel.")
+        try:
+            message = await interaction.channel.fetch_message(int(match.group(2)))
+        except Exception:
+            raise IngestError("❌ I couldn't find that message in this channel.") from None
+        images.extend(message.attachments)
+
+    images = [a for a in images if is_image(a)]
+    if not images:
+        raise IngestError("❌ No image attachments to process.")
+    if len(images) > STEG_BATCH_MAX_IMAGES:
+        raise IngestError(f"❌ That's {len(images)} images; a batch takes at most {STEG_BATCH_MAX_IMAGES}.")
+    return images
+
+
+def unique_names(names: list[str]) -> list[str]:
+    """
+    `names` with repeated stems given an index suffix ("image.png",
+    "image_2.png", "image_3.jpg", ...). Outputs are named after the stem, so
+    this keeps files from different sources apart in one message.
+    """
+    seen = set()
+    unique = []
+    for name in names:
+        stem, ext = os.path.splitext(name)
+        candidate, index = stem, 1
+        while candidate.casefold() in seen:
+            index += 1
+            candidate = f"{stem}_{index}"
+        seen.add(candidate.casefold())
+        unique.append(candidate + ext)
+    return unique
+
+
+async def run_batch(attachments: list, process) -> list[BatchResult]:
+    """
+    Runs `await process(attachment)` for every attachment, at most
+    STEG_BATCH_CONCURRENCY at a time across all batches. Each attachment is
+    downloaded inside its slot, so a queued batch doesn't hold its uploads in
+    memory. Failures are reported per image instead of failing the batch.
+    """
+    async def one(attachment, name):
+        async with _batch_slots:
+            try:
+                return BatchResult(name, await process(attachment))
+            except IngestError as e:
+                return BatchResult(name, None, str(e).removeprefix("❌ "))
+            except Exception as e:
+                return BatchResult(name, None, str(e))
+
+    names = unique_names([a.filename for a in attachments])
+    return await asyncio.gather(*(one(a, name) for a, name in zip(attachments, names)))
+
+
+def drop_oversized(results: list[BatchResult], max_bytes: int = DISCORD_UPLOAD_LIMIT) -> list[BatchResult]:
+    """
+    `results` with outputs too large to upload turned into failures, so they
+    are reported in the summary instead of failing the whole send.
+    """
+    return [
+        r._replace(data=None, error=f"the result is {len(r.data) / 1024 / 1024:.1f} MiB, over the "
+                                    f"{max_bytes / 1024 / 1024:.0f} MiB upload limit")
+        if r.data is not None and len(r.data) > max_bytes else r
+        for r in results
+    ]
+
+
+def chunk_files(files: list[tuple[str, bytes]], max_files: int = MAX_FILES_PER_MESSAGE,
+                max_bytes: int = DISCORD_UPLOAD_LIMIT) -> list[list[tuple[str, bytes]]]:
+    """
+    Splits (filename, data) pairs into groups that fit in one message each,
+    keeping their order. Files over `max_bytes` can't be sent and are left
+    out; see drop_oversized().
+    """
+    chunks, current, size = [], [], 0
+    for name, data in files:
+        if len(data) > max_bytes:
+            continue
+        if current and (len(current) >= max_files or size + len(data) > max_bytes):
+            chunks.append(current)
+            current, size = [], 0
+        current.append((name, data))
+        size += len(data)
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def batch_summary(results: list[BatchResult], done: str) -> str:
+    """
+    "<done> N of M images." plus a line per failed image.
+    """
+    ok = sum(r.data is not None for r in results)
+    lines = [f"{done} {ok} of {len(results)} image{'s' if len(results) != 1 else ''}."]
+    lines += [f"⚠️ `{r.name}`: {r.error}" for r in results if r.data is None]
+    return "\n".join(lines)[:2000]  # Discord's message length limit
@@ -0,0 +1,345 @@
+"""
+Standalone benchmarks for steg_helpers and the SealedBox paths.
+
+    python benchmark.py                              # everything, 0.3-48 MP
+    python benchmark.py --sizes 0.3 2 --only lsb     # a quick subset
+    python benchmark.py --output new.json --baseline old.json --threshold 0.15
+
+Each case runs in a fresh process so its peak RSS isn't inflated by the
+cases before it. Results are written as JSON; with --baseline, cases whose
+median time grew by more than --threshold are reported and the exit status
+is 1, so runs can be compared before and after a change.
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import time
+
+# Measure the encoders themselves, not the retry that kicks in over Discord's upload limit
+os.environ.setdefault("DISCORD_UPLOAD_LIMIT", str(1 << 40))
+
+import numpy as np
+import PIL
+from nacl.public import PrivateKey, SealedBox
+from PIL import Image
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import steg_helpers
+
+# Megapixels -> dimensions of the synthetic test images
+SIZES = {0.3: (640, 480), 2: (1920, 1080), 12: (4000, 3000), 48: (8000, 6000)}
+PAYLOAD_SIZES = (256, 16 * 1024, 1024 * 1024)
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.10
+
+
+def synthetic_image(width: int, height: int, seed: int = 0) -> Image.Image:
+    """
+    Gradients plus blocky and per-pixel noise: compresses about as badly as a
+    real photo and gives the LSB plane realistic statistics. Built in uint8
+    so the 48 MP image doesn't need gigabytes of scratch memory.
+    """
+    rng = np.random.default_rng(seed)
+    x = (np.arange(width, dtype=np.uint32) * 200 // width).astype(np.uint8)
+    y = (np.arange(height, dtype=np.uint32) * 200 // height).astype(np.uint8)
+    arr = np.empty((height, width, 3), dtype=np.uint8)
+    arr[..., 0] = x[None, :]
+    arr[..., 1] = y[:, None]
+    arr[..., 2] = (x[None, :] // 2 + y[:, None] // 2)
+
+    blocks = rng.integers(0, 24, (height // 16 + 1, width // 16 + 1, 3), dtype=np.uint8)
+    arr += np.repeat(np.repeat(blocks, 16, axis=0), 16, axis=1)[:height, :width]
+    arr += rng.integers(0, 32, arr.shape, dtype=np.uint8)
+    return Image.fromarray(arr, "RGB")
+
+
+def _payload(size: int, seed: int = 1) -> bytes:
+    # No null bytes, so it also works as a null-terminated lsb_encode() message
+    return np.random.default_rng(seed).integers(1, 256, size, dtype=np.uint8).tobytes()
+
+
+def _png(img: Image.Image) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", compress_level=1)
+    return buf.getvalue()
+
+
+def _jpeg(img: Image.Image) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=90, exif=b"Exif\x00\x00" + b"\x00" * 64)
+    return buf.getvalue()
+
+
+# --- Cases -------------------------------------------------------------------
+#
+# Each case is setup(megapixels, payload_size) -> callable, so input
+# generation stays out of the timings. Setup returns None to skip a
+# combination (e.g. a payload that doesn't fit the image).
+
+def _lsb_fits(img: Image.Image, size: int) -> bool:
+    return (size + 1) * 8 <= img.width * img.height * 3
+
+
+def setup_lsb_encode(mp, size):
+    img = synthetic_image(*SIZES[mp])
+    message = _payload(size).decode("latin-1")
+    if not _lsb_fits(img, size):
+        return None
+    return lambda: steg_helpers.lsb_encode(img, message)
+
+
+def setup_lsb_decode(mp, size):
+    img = synthetic_image(*SIZES[mp])
+    if not _lsb_fits(img, size):
+        return None
+    steg_helpers.lsb_encode(img, _payload(size).decode("latin-1"))
+    return lambda: steg_helpers.lsb_decode(img)
+
+
+def setup_lsb_embed_payload(mp, size):
+    img = synthetic_image(*SIZES[mp])
+    payload = _payload(size)
+    if size > steg_helpers.lsb_capacity(img):
+        return None
+    return lambda: steg_helpers.lsb_embed_payload(img, payload, 1)
+
+
+def setup_lsb_extract_payload(mp, size):
+    img = synthetic_image(*SIZES[mp])
+    if size > steg_helpers.lsb_capacity(img):
+        return None
+    steg_helpers.lsb_embed_payload(img, _payload(size), 1)
+    return lambda: steg_helpers.lsb_extract_payload(img)
+
+
+def setup_matrix(mp, size):
+    img = synthetic_image(*SIZES[mp])
+    return lambda: steg_helpers.apply_matrix_style_effect(img)
+
+
+def setup_glitch(mp, size):
+    img = synthetic_image(*SIZES[mp])
+    return lambda: steg_helpers.apply_glitch_effect(img)
+
+
+def setup_pixel_sort(mp, size):
+    img = synthetic_image(*SIZES[mp])
+    return lambda: steg_helpers.apply_pixel_sort_effect(img, seed=0)
+
+
+def setup_pixel_sort_luma(mp, size):
+    img = synthetic_image(*SIZES[mp])
+    return lambda: steg_helpers.apply_pixel_sort_effect(img, variant="sort")
+
+
+def setup_watermark(mp, size):
+    img = synthetic_image(*SIZES[mp])
+    return lambda: steg_helpers.watermark_image(img)
+
+
+def setup_sanitize(mp, size):
+    data = _png(synthetic_image(*SIZES[mp]))
+    return lambda: steg_helpers.sanitize_image(data)
+
+
+def setup_sanitize_scramble(mp, size):
+    data = _png(synthetic_image(*SIZES[mp]))
+    return lambda: steg_helpers.sanitize_image(data, scramble_metadata=True)
+
+
+def setup_scrub_png(mp, size):
+    data = _png(synthetic_image(*SIZES[mp]))
+    return lambda: steg_helpers.scrub_image_metadata(data)
+
+
+def setup_scrub_jpeg(mp, size):
+    data = _jpeg(synthetic_image(*SIZES[mp]))
+    return lambda: steg_helpers.scrub_image_metadata(data)
+
+
+def setup_sealedbox_encrypt(mp, size):
+    box = SealedBox(PrivateKey.generate().public_key)
+    payload = _payload(size)
+    return lambda: box.encrypt(payload)
+
+
+def setup_sealedbox_decrypt(mp, size):
+    key = PrivateKey.generate()
+    ciphertext = SealedBox(key.public_key).encrypt(_payload(size))
+    box = SealedBox(key)
+    return lambda: box.decrypt(ciphertext)
+
+
+# name -> (setup, uses images, uses payloads)
+CASES = {
+    "lsb_encode": (setup_lsb_encode, True, True),
+    "lsb_decode": (setup_lsb_decode, True, True),
+    "lsb_embed_payload": (setup_lsb_embed_payload, True, True),
+    "lsb_extract_payload": (setup_lsb_extract_payload, True, True),
+    "matrix": (setup_matrix, True, False),
+    "glitch": (setup_glitch, True, False),
+    "pixel_sort": (setup_pixel_sort, True, False),
+    "pixel_sort_luma": (setup_pixel_sort_luma, True, False),
+    "watermark": (setup_watermark, True, False),
+    "sanitize": (setup_sanitize, True, False),
+    "sanitize_scramble": (setup_sanitize_scramble, True, False),
+    "scrub_png": (setup_scrub_png, True, False),
+    "scrub_jpeg": (setup_scrub_jpeg, True, False),
+    "sealedbox_encrypt": (setup_sealedbox_encrypt, False, True),
+    "sealedbox_decrypt": (setup_sealedbox_decrypt, False, True),
+}
+
+
+def _peak_rss_bytes() -> int | None:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_case(name: str, mp: float | None, size: int | None, repeat: int) -> dict | None:
+    """
+    Times one case and returns its result row, or None if it was skipped.
+    """
+    setup, _, _ = CASES[name]
+    func = setup(mp, size)
+    if func is None:
+        return None
+
+    rss_before = _peak_rss_bytes()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    rss_after = _peak_rss_bytes()
+
+    median = statistics.median(times)
+    if size is not None:
+        # Payload cases scale with the payload; image cases with the pixel count
+        throughput, unit = size / 1024 / 1024 / median, "MiB/s"
+    else:
+        throughput, unit = mp / median, "MP/s"
+
+    row = {
+        "name": name,
+        "megapixels": mp,
+        "payload_bytes": size,
+        "seconds": round(median, 6),
+        "min_seconds": round(min(times), 6),
+        "throughput": round(throughput, 3),
+        "unit": unit,
+    }
+    if rss_after is not None:
+        row["peak_rss_mib"] = round(rss_after / 1024 / 1024, 1)
+        row["rss_growth_mib"] = round((rss_after - rss_before) / 1024 / 1024, 1)
+    return row
+
+
+def _run_isolated(args) -> dict | None:
+    with multiprocessing.get_context().Pool(1, maxtasksperchild=1) as worker:
+        return worker.apply(run_case, args)
+
+
+def case_key(row: dict) -> tuple:
+    return row["name"], row["megapixels"], row["payload_bytes"]
+
+
+def compare(results: list[dict], baseline: list[dict], threshold: float) -> list[str]:
+    """
+    Lines describing cases whose median time grew by more than `threshold`
+    (a fraction, 0.1 = 10%) compared with the baseline run.
+    """
+    old = {case_key(row): row for row in baseline}
+    regressions = []
+    for row in results:
+        before = old.get(case_key(row))
+        if not before or not before["seconds"]:
+            continue
+        change = row["seconds"] / before["seconds"] - 1
+        if change > threshold:
+            regressions.append(
+                f"{_label(row)}: {before['seconds']:.4f}s -> {row['seconds']:.4f}s ({change:+.0%})"
+            )
+    return regressions
+
+
+def _label(row: dict) -> str:
+    parts = [row["name"]]
+    if row["megapixels"] is not None:
+        parts.append(f"{row['megapixels']:g} MP")
+    if row["payload_bytes"] is not None:
+        parts.append(f"{row['payload_bytes']} B")
+    return " @ ".join(parts)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark StegBot image and crypto paths.")
+    parser.add_argument("--sizes", type=float, nargs="+", default=list(SIZES),
+                        choices=list(SIZES), help="image sizes in megapixels")
+    parser.add_argument("--payloads", type=int, nargs="+", default=list(PAYLOAD_SIZES),
+                        help="payload sizes in bytes")
+    parser.add_argument("--only", nargs="+", help="run only cases whose name contains one of these")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="timed runs per case")
+    parser.add_argument("--output", help="write JSON results here")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed slowdown versus the baseline (0.1 = 10%%)")
+    parser.add_argument("--no-isolate", action="store_true",
+                        help="run every case in this process (faster, but peak RSS accumulates)")
+    args = parser.parse_args(argv)
+
+    jobs = []
+    for name, (_, uses_images, uses_payloads) in CASES.items():
+        if args.only and not any(part in name for part in args.only):
+            continue
+        for mp in (args.sizes if uses_images else [None]):
+            for size in (args.payloads if uses_payloads else [None]):
+                jobs.append((name, mp, size, args.repeat))
+
+    results = []
+    for job in jobs:
+        row = run_case(*job) if args.no_isolate else _run_isolated(job)
+        if row is None:
+            continue
+        results.append(row)
+        rss = f"  peak {row['peak_rss_mib']:.0f} MiB" if "peak_rss_mib" in row else ""
+        print(f"{_label(row):40} {row['seconds']:9.4f}s  {row['throughput']:10.2f} {row['unit']}{rss}", flush=True)
+
+    report = {
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} case(s) slower than the baseline by more than {args.threshold:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\n✅ No regressions over {args.threshold:.0%} against {args.baseline}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
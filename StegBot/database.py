@@ -1,8 +1,22 @@
+import functools
 import os
-import mysql.connector
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
 from cryptography.fernet import Fernet
 from dotenv import load_dotenv
 
+from metrics import registry
+
+try:
+    import mysql.connector
+    from mysql.connector import errors as mysql_errors
+except ImportError:  # only needed for KEY_STORE=mysql
+    mysql = None
+
 # Load environment variables
 load_dotenv()
 
@@ -14,6 +28,12 @@ if not FERNET_SECRET:
 FERNET_KEY = FERNET_SECRET.encode()
 fernet = Fernet(FERNET_KEY)
 
+# Which backend holds the keys: "mysql" (remote server) or "sqlite" (local file)
+KEY_STORE = os.getenv("KEY_STORE", "mysql").lower()
+KEY_STORE_PATH = os.getenv("KEY_STORE_PATH") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "stegbot_keys.sqlite3"
+)
+
 # DB connection info
 DB_HOST = "YOUR_HOST_IP"
 DB_PORT = 3306
@@ -21,61 +41,597 @@ DB_USER = "DATABASE_USERNAME"
 DB_PASS = os.getenv("DB_PASS")  # Must be set in .env
 DB_NAME = "DB_NAME_steg_securebot"
 
-def get_connection():
+# Connection pool settings
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+# Seconds a caller waits for a free connection before giving up
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+# Connections idle for longer than this are pinged before being handed out
+DB_POOL_PING_AFTER = float(os.getenv("DB_POOL_PING_AFTER", "30"))
+
+# Errors that mean the connection itself is unusable
+CONNECTION_ERRORS = (mysql_errors.OperationalError, mysql_errors.InterfaceError) if mysql else ()
+
+# Calls slower than this (seconds, end to end) are logged
+DB_SLOW_QUERY_SECONDS = float(os.getenv("DB_SLOW_QUERY_SECONDS", "0.5"))
+
+DB_CALL_SECONDS = registry.histogram(
+    "stegbot_db_call_seconds", "End-to-end time of key store calls", ("operation",)
+)
+DB_PHASE_SECONDS = registry.histogram(
+    "stegbot_db_phase_seconds",
+    "Time spent per phase of key store calls (pool_wait, connect, execute, fetch, encrypt, decrypt)",
+    ("operation", "phase")
+)
+DB_ERRORS = registry.counter("stegbot_db_errors_total", "Failed key store calls", ("operation", "error"))
+DB_POOL_WAIT_SECONDS = registry.counter(
+    "stegbot_db_pool_wait_seconds_total", "Time spent waiting for a free key store connection"
+)
+DB_SLOW_QUERIES = registry.counter(
+    "stegbot_db_slow_queries_total", "Key store calls slower than DB_SLOW_QUERY_SECONDS", ("operation",)
+)
+
+# The call being timed on this thread; DB work runs in to_thread workers, one call per thread
+_timing = threading.local()
+
+
+def _record(phase: str, seconds: float):
+    phases = getattr(_timing, "phases", None)
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+@contextmanager
+def _phase(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, time.perf_counter() - start)
+
+
+def instrumented(operation: str):
+    """
+    Times a key store call and its phases into the DB_* metrics, counts its
+    failures, and logs it if it was slow.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            outer = getattr(_timing, "phases", None)
+            _timing.phases = phases = {}
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                DB_ERRORS.inc(operation, type(e).__name__)
+                raise
+            finally:
+                _timing.phases = outer
+                total = time.perf_counter() - start
+                DB_CALL_SECONDS.observe(total, operation)
+                for phase, seconds in phases.items():
+                    DB_PHASE_SECONDS.observe(seconds, operation, phase)
+                if total >= DB_SLOW_QUERY_SECONDS:
+                    DB_SLOW_QUERIES.inc(operation)
+                    breakdown = ", ".join(f"{phase} {seconds * 1000:.1f} ms" for phase, seconds in phases.items())
+                    print(f"🐢 Slow DB call {operation}: {total * 1000:.1f} ms" + (f" ({breakdown})" if breakdown else ""))
+        return wrapper
+    return decorator
+
+
+def get_connection(**kwargs):
+    """
+    Opens a new, unpooled MySQL connection. Use the key store for queries.
+    """
     return mysql.connector.connect(
         host=DB_HOST,
         port=DB_PORT,
         user=DB_USER,
         password=DB_PASS,
-        database=DB_NAME
+        database=DB_NAME,
+        **kwargs
     )
 
+
+class PoolTimeout(Exception):
+    """No connection became free within the pool's timeout."""
+
+
+class ConnectionPool:
+    """
+    Fixed-size pool of MySQL connections shared by the bot's threads.
+    Connections are opened on demand up to `size`; callers beyond that wait
+    for one to be returned. Connections idle for more than `ping_after`
+    seconds are pinged on checkout and replaced if the server dropped them,
+    and a connection that fails mid-query is discarded instead of reused.
+    """
+
+    def __init__(self, connect, size: int = DB_POOL_SIZE, timeout: float = DB_POOL_TIMEOUT,
+                 ping_after: float = DB_POOL_PING_AFTER):
+        self._connect = connect
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self._idle = []  # (connection, returned at); the most recently used is reused first
+        self._open = 0
+        self._cond = threading.Condition()
+
+        self.in_use = 0
+        self.waiters = 0
+        self.checkouts = 0
+        self.max_wait_seconds = 0.0
+        self.timeouts = 0
+        self.reconnects = 0
+
+    @contextmanager
+    def connection(self):
+        conn = self._checkout()
+        broken = False
+        try:
+            yield conn
+        except CONNECTION_ERRORS:
+            broken = True
+            raise
+        finally:
+            self._checkin(conn, broken)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self.size,
+                "open": self._open,
+                "in_use": self.in_use,
+                "idle": len(self._idle),
+                "waiters": self.waiters,
+                "checkouts": self.checkouts,
+                "wait_seconds_max": round(self.max_wait_seconds, 6),
+                "timeouts": self.timeouts,
+                "reconnects": self.reconnects,
+            }
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for conn, _ in idle:
+            self._close(conn)
+
+    def _checkout(self):
+        start = time.monotonic()
+        with self._cond:
+            self.waiters += 1
+            try:
+                while not self._idle and self._open >= self.size:
+                    remaining = self.timeout - (time.monotonic() - start)
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout(f"No database connection free after {self.timeout:g}s.")
+                    self._cond.wait(remaining)
+            finally:
+                self.waiters -= 1
+
+            waited = time.monotonic() - start
+            _record("pool_wait", waited)
+            self.checkouts += 1
+            DB_POOL_WAIT_SECONDS.inc(amount=waited)
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+            self.in_use += 1
+            if self._idle:
+                conn, returned_at = self._idle.pop()
+            else:
+                conn, returned_at = None, None
+                self._open += 1  # reserve the slot; connect outside the lock
+
+        try:
+            if conn is None:
+                with _phase("connect"):
+                    return self._connect()
+            if time.monotonic() - returned_at > self.ping_after:
+                with _phase("connect"):
+                    return self._revive(conn)
+            return conn
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self.in_use -= 1
+                self._cond.notify()
+            raise
+
+    def _revive(self, conn):
+        try:
+            conn.ping(reconnect=False)
+            return conn
+        except CONNECTION_ERRORS:
+            self._close(conn)
+            with self._cond:
+                self.reconnects += 1
+            return self._connect()
+
+    def _checkin(self, conn, broken: bool):
+        if not broken:
+            try:
+                # Don't hand the next caller an open transaction
+                if conn.in_transaction:
+                    conn.rollback()
+            except Exception:
+                broken = True
+        if broken:
+            self._close(conn)
+
+        with self._cond:
+            self.in_use -= 1
+            if broken:
+                self._open -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+class KeyStore(ABC):
+    """
+    Where keypairs live. Private keys arrive and leave Fernet-encrypted;
+    the module-level functions below do the encryption. Backends implement
+    every abstract method, or fail when they're constructed.
+    """
+
+    @abstractmethod
+    def init(self):
+        """Creates the user_keys table if it doesn't exist."""
+
+    @abstractmethod
+    def ready(self) -> bool:
+        """True if the user_keys table exists."""
+
+    @abstractmethod
+    def put(self, user_id: int, public_key: str, encrypted_private_key: str):
+        """Stores a keypair, replacing any the user already has."""
+
+    @abstractmethod
+    def get_public(self, user_id: int) -> str | None:
+        """The user's public key, or None if they have no keys."""
+
+    def get_public_many(self, user_ids: list[int]) -> dict[int, str]:
+        """
+        {user_id: public key} for those of `user_ids` that have keys.
+        Backends override this with a single query.
+        """
+        keys = {}
+        for user_id in user_ids:
+            public_key = self.get_public(user_id)
+            if public_key:
+                keys[user_id] = public_key
+        return keys
+
+    @abstractmethod
+    def get_encrypted_private(self, user_id: int) -> str | None:
+        """The user's Fernet-encrypted private key, or None if they have no keys."""
+
+    @abstractmethod
+    def delete(self, user_id: int) -> bool:
+        """Deletes the user's keypair; False if they didn't have one."""
+
+    @abstractmethod
+    def list_public_page(self, after: str | None, limit: int) -> list[tuple[str, str]]:
+        """
+        Up to `limit` (user_id, public_key) rows with user_id > `after`, ordered by user_id.
+        """
+
+    def iter_public(self, batch_size: int = 500):
+        """
+        Every (user_id, public_key) row in user_id order, fetched a page at a time.
+        """
+        after = None
+        while True:
+            rows = self.list_public_page(after, batch_size)
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            after = rows[-1][0]
+
+    def stats(self) -> dict:
+        return {}
+
+    def close(self):
+        pass
+
+
+class MySQLKeyStore(KeyStore):
+    """
+    Keys in the MySQL server configured above, over a ConnectionPool.
+    """
+
+    def __init__(self):
+        if mysql is None:
+            raise RuntimeError("❌ KEY_STORE=mysql needs mysql-connector-python installed.")
+        # Autocommit, so a pooled connection never holds a read snapshot between calls
+        self.pool = ConnectionPool(lambda: get_connection(autocommit=True))
+
+    def _execute(self, sql: str, params: tuple = (), fetch: str | None = None):
+        """
+        Runs one statement on a pooled connection and returns the fetched row(s)
+        ("one"/"all") or the affected row count. Every statement here is safe to
+        repeat, so it is retried once on a fresh connection if the pooled one
+        turns out to be dead.
+        """
+        for attempt in (1, 2):
+            try:
+                with self.pool.connection() as conn, conn.cursor() as cursor:
+                    with _phase("execute"):
+                        cursor.execute(sql, params)
+                    with _phase("fetch"):
+                        if fetch == "one":
+                            return cursor.fetchone()
+                        if fetch == "all":
+                            return cursor.fetchall()
+                    return cursor.rowcount
+            except CONNECTION_ERRORS:
+                if attempt == 2:
+                    raise
+
+    def init(self):
+        self._execute("""
+            CREATE TABLE IF NOT EXISTS user_keys (
+                user_id VARCHAR(32) PRIMARY KEY,
+                public_key TEXT NOT NULL,
+                encrypted_private_key TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+    def ready(self) -> bool:
+        return self._execute("SHOW TABLES LIKE 'user_keys'", fetch="one") is not None
+
+    def put(self, user_id: int, public_key: str, encrypted_private_key: str):
+        self._execute("""
+            INSERT INTO user_keys (user_id, public_key, encrypted_private_key)
+            VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                public_key = VALUES(public_key),
+                encrypted_private_key = VALUES(encrypted_private_key)
+        """, (str(user_id), public_key, encrypted_private_key))
+
+    def get_public(self, user_id: int) -> str | None:
+        result = self._execute("SELECT public_key FROM user_keys WHERE user_id = %s", (str(user_id),), fetch="one")
+        return result[0] if result else None
+
+    def get_public_many(self, user_ids: list[int]) -> dict[int, str]:
+        if not user_ids:
+            return {}
+        rows = self._execute(
+            f"SELECT user_id, public_key FROM user_keys WHERE user_id IN ({', '.join(['%s'] * len(user_ids))})",
+            tuple(str(user_id) for user_id in user_ids), fetch="all"
+        )
+        return {int(user_id): public_key for user_id, public_key in rows}
+
+    def get_encrypted_private(self, user_id: int) -> str | None:
+        result = self._execute(
+            "SELECT encrypted_private_key FROM user_keys WHERE user_id = %s", (str(user_id),), fetch="one"
+        )
+        return result[0] if result else None
+
+    def delete(self, user_id: int) -> bool:
+        return self._execute("DELETE FROM user_keys WHERE user_id = %s", (str(user_id),)) > 0
+
+    def list_public_page(self, after: str | None, limit: int) -> list[tuple[str, str]]:
+        # Keyset pagination: seeks straight to `after` on the primary key instead of skipping rows
+        if after is None:
+            return self._execute(
+                "SELECT user_id, public_key FROM user_keys ORDER BY user_id LIMIT %s", (limit,), fetch="all"
+            )
+        return self._execute(
+            "SELECT user_id, public_key FROM user_keys WHERE user_id > %s ORDER BY user_id LIMIT %s",
+            (after, limit), fetch="all"
+        )
+
+    def stats(self) -> dict:
+        return self.pool.stats()
+
+    def close(self):
+        self.pool.close()
+
+
+class SQLiteKeyStore(KeyStore):
+    """
+    Keys in a local SQLite file, for single-node deployments and offline runs.
+    The database is in WAL mode so lookups never wait for a write. Each thread
+    gets its own connection, and sqlite3 keeps the compiled statements of each
+    connection cached, so repeated lookups skip parsing and planning.
+    """
+
+    def __init__(self, path: str = KEY_STORE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            with _phase("connect"):
+                # Autocommit: every statement here is its own transaction
+                conn = sqlite3.connect(self.path, timeout=DB_POOL_TIMEOUT, isolation_level=None,
+                                       check_same_thread=False, cached_statements=32)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _execute(self, sql: str, params: tuple = (), fetch: str | None = None):
+        """
+        Same contract as MySQLKeyStore._execute().
+        """
+        conn = self._connection()
+        with _phase("execute"):
+            cursor = conn.execute(sql, params)
+        with _phase("fetch"):
+            if fetch == "one":
+                return cursor.fetchone()
+            if fetch == "all":
+                return cursor.fetchall()
+        return cursor.rowcount
+
+    def init(self):
+        self._execute("""
+            CREATE TABLE IF NOT EXISTS user_keys (
+                user_id TEXT PRIMARY KEY,
+                public_key TEXT NOT NULL,
+                encrypted_private_key TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+    def ready(self) -> bool:
+        return self._execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_keys'", fetch="one"
+        ) is not None
+
+    def put(self, user_id: int, public_key: str, encrypted_private_key: str):
+        self._execute("""
+            INSERT INTO user_keys (user_id, public_key, encrypted_private_key)
+            VALUES (?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET
+                public_key = excluded.public_key,
+                encrypted_private_key = excluded.encrypted_private_key
+        """, (str(user_id), public_key, encrypted_private_key))
+
+    def get_public(self, user_id: int) -> str | None:
+        result = self._execute("SELECT public_key FROM user_keys WHERE user_id = ?", (str(user_id),), fetch="one")
+        return result[0] if result else None
+
+    def get_public_many(self, user_ids: list[int]) -> dict[int, str]:
+        if not user_ids:
+            return {}
+        rows = self._execute(
+            f"SELECT user_id, public_key FROM user_keys WHERE user_id IN ({', '.join('?' * len(user_ids))})",
+            tuple(str(user_id) for user_id in user_ids), fetch="all"
+        )
+        return {int(user_id): public_key for user_id, public_key in rows}
+
+    def get_encrypted_private(self, user_id: int) -> str | None:
+        result = self._execute(
+            "SELECT encrypted_private_key FROM user_keys WHERE user_id = ?", (str(user_id),), fetch="one"
+        )
+        return result[0] if result else None
+
+    def delete(self, user_id: int) -> bool:
+        return self._execute("DELETE FROM user_keys WHERE user_id = ?", (str(user_id),)) > 0
+
+    def list_public_page(self, after: str | None, limit: int) -> list[tuple[str, str]]:
+        return self._execute(
+            "SELECT user_id, public_key FROM user_keys WHERE user_id > ? ORDER BY user_id LIMIT ?",
+            ("" if after is None else after, limit), fetch="all"
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"connections": len(self._connections)}
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+
+def open_key_store(kind: str = KEY_STORE) -> KeyStore:
+    if kind == "mysql":
+        return MySQLKeyStore()
+    if kind == "sqlite":
+        return SQLiteKeyStore()
+    raise RuntimeError(f"❌ Unknown KEY_STORE {kind!r}; use 'mysql' or 'sqlite'.")
+
+
+key_store = open_key_store()
+registry.gauges("stegbot_db_pool", "Key store connections", lambda: key_store.stats())
+
+
+@instrumented("init_db")
 def init_db():
     print("🔧 Initializing secure DB...")
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS user_keys (
-            user_id VARCHAR(32) PRIMARY KEY,
-            public_key TEXT NOT NULL,
-            encrypted_private_key TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    conn.commit()
-    conn.close()
+    key_store.init()
     print("✅ Database initialized and ready.")
 
+@instrumented("verify_db_ready")
+def _verify_tables() -> bool:
+    return key_store.ready()
+
+def verify_db_ready():
+    """
+    Checks if the expected tables exist. Returns True if ready, False if not.
+    """
+    try:
+        return _verify_tables()
+    except Exception as e:
+        print(f"⚠️ DB verification failed: {e}")
+        return False
+
+@instrumented("store_user_keys")
 def store_user_keys(user_id: int, public_key_hex: str, private_key_hex: str):
-    encrypted_private = fernet.encrypt(private_key_hex.encode()).decode()
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO user_keys (user_id, public_key, encrypted_private_key)
-        VALUES (%s, %s, %s)
-        ON DUPLICATE KEY UPDATE
-            public_key = VALUES(public_key),
-            encrypted_private_key = VALUES(encrypted_private_key)
-    """, (str(user_id), public_key_hex, encrypted_private))
-    conn.commit()
-    conn.close()
-
-def load_user_keys(user_id: int):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT public_key, encrypted_private_key FROM user_keys WHERE user_id = %s", (str(user_id),))
-    result = cursor.fetchone()
-    conn.close()
-
-    if not result:
+    with _phase("encrypt"):
+        encrypted_private = fernet.encrypt(private_key_hex.encode()).decode()
+    key_store.put(user_id, public_key_hex, encrypted_private)
+
+@instrumented("load_public_key")
+def load_public_key(user_id: int) -> str | None:
+    """
+    Just the public key hex, without touching the encrypted private key.
+    """
+    return key_store.get_public(user_id)
+
+@instrumented("load_public_keys")
+def load_public_keys(user_ids: list[int]) -> dict[int, str]:
+    """
+    {user_id: public key hex} for every one of `user_ids` that has keys, in one query.
+    """
+    return key_store.get_public_many(user_ids)
+
+@instrumented("load_private_key")
+def load_private_key(user_id: int) -> str | None:
+    """
+    The decrypted private key hex. Only call this when something is about to be decrypted.
+    """
+    encrypted_priv = key_store.get_encrypted_private(user_id)
+    if not encrypted_priv:
         return None
+    with _phase("decrypt"):
+        return fernet.decrypt(encrypted_priv.encode()).decode()
+
+@instrumented("delete_user_keys")
+def delete_user_keys(user_id: int) -> bool:
+    """
+    Deletes a user's keypair. Returns False if they didn't have one.
+    """
+    return key_store.delete(user_id)
+
+@instrumented("list_public_keys_page")
+def list_public_keys_page(after: str | None, limit: int):
+    """
+    One page of (user_id, public_key) rows after the `after` user_id, ordered by user_id.
+    """
+    return key_store.list_public_page(after, limit)
 
-    pub, encrypted_priv = result
-    decrypted_priv = fernet.decrypt(encrypted_priv.encode()).decode()
-    return {
-        "public_key": pub,
-        "private_key": decrypted_priv
-    }
+@instrumented("export_public_keys")
+def export_public_keys(fp, batch_size: int = 500) -> int:
+    """
+    Writes every stored public key to the binary file `fp` as CSV, one page
+    of rows at a time. Returns the number of keys written.
+    """
+    count = 0
+    fp.write(b"user_id,public_key\n")
+    for user_id, public_key in key_store.iter_public(batch_size):
+        fp.write(f"{user_id},{public_key}\n".encode())
+        count += 1
+    return count
 
 if __name__ == "__main__":
     init_db()
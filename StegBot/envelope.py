@@ -0,0 +1,80 @@
+import struct
+
+import nacl.utils
+from nacl.exceptions import CryptoError
+from nacl.public import PrivateKey, PublicKey, SealedBox
+from nacl.secret import SecretBox
+
+# Multi-recipient messages: the payload is encrypted once with a random
+# SecretBox key, and only that key is sealed to each recipient.
+#
+#   "SMR" | version (1 byte) | slot count (2 bytes) | slots | SecretBox ciphertext
+#
+# A slot is SealedBox(recipient).encrypt(key). Slots carry no recipient IDs;
+# a recipient finds theirs by trying to open each one, the same way a plain
+# SealedBox doesn't say who it's for.
+ENVELOPE_MAGIC = b"SMR"
+ENVELOPE_VERSION = 1
+_ENVELOPE_HEADER = struct.Struct(">3sBH")
+
+# Sealed key: ephemeral public key + MAC + the SecretBox key
+SLOT_SIZE = PublicKey.SIZE + SecretBox.MACBYTES + SecretBox.KEY_SIZE
+MAX_SLOTS = 0xFFFF
+
+
+def encrypt_for_recipients(message: bytes, public_keys: list[bytes]) -> tuple[list[bytes], bytes]:
+    """
+    Encrypts `message` once and wraps its key for each public key.
+    Returns (one slot per public key, in order; the shared ciphertext).
+    """
+    if not 0 < len(public_keys) <= MAX_SLOTS:
+        raise ValueError(f"Need between 1 and {MAX_SLOTS} recipients.")
+    key = nacl.utils.random(SecretBox.KEY_SIZE)
+    body = bytes(SecretBox(key).encrypt(message))
+    slots = [SealedBox(PublicKey(public_key)).encrypt(key) for public_key in public_keys]
+    return slots, body
+
+
+def pack_envelope(slots: list[bytes], body: bytes) -> bytes:
+    """
+    An envelope any of the recipients behind `slots` can open.
+    """
+    return _ENVELOPE_HEADER.pack(ENVELOPE_MAGIC, ENVELOPE_VERSION, len(slots)) + b"".join(slots) + body
+
+
+def is_envelope(data: bytes) -> bool:
+    if len(data) < _ENVELOPE_HEADER.size:
+        return False
+    magic, version, count = _ENVELOPE_HEADER.unpack_from(data)
+    return (magic == ENVELOPE_MAGIC and version == ENVELOPE_VERSION and count > 0
+            and len(data) > _ENVELOPE_HEADER.size + count * SLOT_SIZE)
+
+
+def open_envelope(data: bytes, private_key: PrivateKey) -> bytes:
+    """
+    The message in an envelope. Raises CryptoError if none of its slots
+    is for `private_key`.
+    """
+    _, _, count = _ENVELOPE_HEADER.unpack_from(data)
+    body_start = _ENVELOPE_HEADER.size + count * SLOT_SIZE
+    unseal = SealedBox(private_key)
+    for offset in range(_ENVELOPE_HEADER.size, body_start, SLOT_SIZE):
+        try:
+            key = unseal.decrypt(data[offset:offset + SLOT_SIZE])
+        except CryptoError:
+            continue
+        return SecretBox(key).decrypt(data[body_start:])
+    raise CryptoError("None of the recipients' keys match.")
+
+
+def decrypt_message(data: bytes, private_key: PrivateKey) -> bytes:
+    """
+    Decrypts either a multi-recipient envelope or a plain single-recipient
+    SealedBox ciphertext.
+    """
+    if is_envelope(data):
+        try:
+            return open_envelope(data, private_key)
+        except CryptoError:
+            pass  # a SealedBox whose random prefix happens to look like a header
+    return SealedBox(private_key).decrypt(data)
@@ -0,0 +1,68 @@
+import asyncio
+import os
+import re
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Most recipients one multi-recipient message can have
+STEG_MAX_RECIPIENTS = int(os.getenv("STEG_MAX_RECIPIENTS", "50"))
+# DMs being sent at once across all fan-outs
+DM_FANOUT_CONCURRENCY = int(os.getenv("DM_FANOUT_CONCURRENCY", "5"))
+# Seconds between starting two DMs; keeps a big fan-out well under Discord's global rate limit
+DM_FANOUT_INTERVAL = float(os.getenv("DM_FANOUT_INTERVAL", "0.2"))
+
+USER_REFERENCE = re.compile(r"<@!?(\d{15,20})>|\b(\d{15,20})\b")
+
+
+class Pacer:
+    """
+    Spaces out calls so that at most one starts every `interval` seconds.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            if self._next > now:
+                await asyncio.sleep(self._next - now)
+            self._next = max(now, self._next) + self.interval
+
+
+# Shared by every fan-out, since Discord's limits are per bot, not per command
+_dm_slots = asyncio.Semaphore(DM_FANOUT_CONCURRENCY)
+_dm_pacer = Pacer(DM_FANOUT_INTERVAL)
+
+
+def parse_user_ids(text: str | None) -> list[int]:
+    """
+    User IDs from a string of mentions and/or raw IDs, in order, without duplicates.
+    """
+    if not text:
+        return []
+    ids = (int(mention or raw) for mention, raw in USER_REFERENCE.findall(text))
+    return list(dict.fromkeys(ids))
+
+
+async def fan_out(recipients: list, send) -> list[tuple[object, Exception]]:
+    """
+    Runs `await send(recipient)` for every recipient, paced and at most
+    DM_FANOUT_CONCURRENCY at a time across all fan-outs. Returns
+    (recipient, error) for each send that failed; the others still go out.
+    """
+    async def one(recipient):
+        async with _dm_slots:
+            await _dm_pacer.wait()
+            try:
+                await send(recipient)
+            except Exception as e:
+                return recipient, e
+            return None
+
+    results = await asyncio.gather(*(one(r) for r in recipients))
+    return [failure for failure in results if failure is not None]
@@ -0,0 +1,115 @@
+import io
+import os
+
+from dotenv import load_dotenv
+import PIL
+from PIL import Image, features
+
+load_dotenv()
+
+# Largest file the bot will try to upload (Discord's default attachment limit is 10 MiB)
+DISCORD_UPLOAD_LIMIT = int(os.getenv("DISCORD_UPLOAD_LIMIT", str(10 * 1024 * 1024)))
+# Images above this many pixels default to the fast profile
+FAST_PROFILE_PIXELS = int(os.getenv("STEG_FAST_PROFILE_PIXELS", "2000000"))
+
+WEBP_MAX_SIDE = 16383
+HAS_WEBP = features.check("webp")
+
+# Named encoder profiles. "png" is always used for steg carriers (and when WebP
+# isn't available); "webp" is lossless WebP for visual-only outputs.
+#
+# Defaults come from encoder_benchmarks.json (Pillow 12, one core, synthetic
+# photo-like images and Matrix effect outputs at 0.3/2/12 MP):
+# - PNG optimize=True is only 1-4% smaller than level 6 and up to 1.6x slower.
+# - Lossless WebP method 0 is 2-4x faster than PNG level 1 at about the same size.
+# - Lossless WebP method 4 is the smallest practical setting (3-6% under
+#   PNG optimize); method 6 was 7-50x slower than that for no further gain.
+ENCODER_PROFILES = {
+    "fast": {
+        "png": {"compress_level": 1},
+        "webp": {"lossless": True, "method": 0, "quality": 0},
+    },
+    "balanced": {
+        "png": {"compress_level": 6},
+        "webp": None,  # WebP method 4 took 4x longer than PNG level 6 on effect outputs
+    },
+    "smallest": {
+        "png": {"optimize": True},
+        "webp": {"lossless": True, "method": 4, "quality": 50},
+    },
+}
+
+
+def choose_profile(img: Image.Image) -> str:
+    """
+    Default profile for an image: balanced for ordinary sizes, fast for large
+    images where a slow zlib search would dominate the request.
+    """
+    return "fast" if img.width * img.height > FAST_PROFILE_PIXELS else "balanced"
+
+
+def _encode(img: Image.Image, profile: str, carrier: bool, exif: bytes | None) -> tuple[bytes, str]:
+    settings = ENCODER_PROFILES[profile]
+    webp = settings["webp"]
+    use_webp = (
+        webp is not None and not carrier and HAS_WEBP
+        and max(img.size) <= WEBP_MAX_SIDE
+    )
+
+    output = io.BytesIO()
+    options = dict(webp if use_webp else settings["png"])
+    if exif:
+        options["exif"] = exif
+    img.save(output, format="WEBP" if use_webp else "PNG", **options)
+    return output.getvalue(), "webp" if use_webp else "png"
+
+
+def encode_image(img: Image.Image, *, carrier: bool = False, profile: str | None = None,
+                 exif: bytes | None = None) -> tuple[bytes, str]:
+    """
+    Encodes `img` losslessly and returns (data, file extension).
+
+    Steg carriers (carrier=True) are always PNG. Without an explicit profile the
+    profile is picked by pixel count, and an output over DISCORD_UPLOAD_LIMIT is
+    re-encoded with the smallest profile before giving up.
+    """
+    if profile is not None and profile not in ENCODER_PROFILES:
+        raise ValueError(f"Unknown encoder profile: {profile}")
+
+    data, ext = _encode(img, profile or choose_profile(img), carrier, exif)
+    if profile is None and len(data) > DISCORD_UPLOAD_LIMIT:
+        data, ext = _encode(img, "smallest", carrier, exif)
+
+    if len(data) > DISCORD_UPLOAD_LIMIT:
+        raise ValueError(
+            f"Encoded image is {len(data) / 1024 / 1024:.1f} MiB, over the "
+            f"{DISCORD_UPLOAD_LIMIT / 1024 / 1024:.0f} MiB upload limit."
+        )
+    return data, ext
+
+
+def encoder_settings() -> dict:
+    """
+    Everything besides the image that decides encode_image's output, for
+    result cache keys: cached images go stale when any of it changes.
+    """
+    return {
+        "profiles": ENCODER_PROFILES,
+        "fast_pixels": FAST_PROFILE_PIXELS,
+        "upload_limit": DISCORD_UPLOAD_LIMIT,
+        "webp": HAS_WEBP,
+        "pillow": PIL.__version__,
+    }
+
+
+def image_extension(data: bytes) -> str:
+    """
+    File extension for encoded image bytes, from their signature.
+    """
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data[:3] == b"\xff\xd8\xff":
+        return "jpg"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    return "png"
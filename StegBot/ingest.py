@@ -0,0 +1,114 @@
+import io
+import math
+import os
+import warnings
+from typing import NamedTuple
+
+from dotenv import load_dotenv
+from PIL import Image
+
+load_dotenv()
+
+# Largest attachment the bot will download at all
+MAX_UPLOAD_BYTES = int(os.getenv("STEG_MAX_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+# Largest image (width x height) the bot will decode at full resolution
+MAX_DECODE_PIXELS = int(os.getenv("STEG_MAX_DECODE_PIXELS", "50000000"))
+# Steg carriers can't be resized, so they get their own (usually tighter) budget
+MAX_CARRIER_PIXELS = int(os.getenv("STEG_MAX_CARRIER_PIXELS", "24000000"))
+# Visual effects are applied at most at this size; larger images are downscaled first
+MAX_EFFECT_PIXELS = int(os.getenv("STEG_MAX_EFFECT_PIXELS", "12000000"))
+
+# Let our own budgets decide; Pillow's bomb check would fire before ours otherwise
+Image.MAX_IMAGE_PIXELS = max(MAX_DECODE_PIXELS, MAX_CARRIER_PIXELS)
+
+
+class IngestError(Exception):
+    """An upload was refused; the message is safe to show to the user."""
+
+
+class RawFrame(NamedTuple):
+    """
+    A decoded image as plain bytes, so it can be kept between menu selections
+    and handed to worker processes without decoding the upload again.
+    """
+    mode: str
+    size: tuple[int, int]
+    data: bytes
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.data)
+
+
+def image_size(image_bytes: bytes) -> tuple[int, int]:
+    """
+    Width and height declared in the image header. Doesn't decode any pixels.
+    """
+    try:
+        with warnings.catch_warnings():
+            # check_image() reports oversized images with a better message
+            warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+            with Image.open(io.BytesIO(image_bytes)) as img:
+                return img.size
+    except Image.DecompressionBombError:
+        raise IngestError("❌ That image is far too large to process.") from None
+    except Exception:
+        raise IngestError("❌ That file isn't an image I can read.") from None
+
+
+def check_image(image_bytes: bytes, *, carrier: bool = False) -> tuple[int, int]:
+    """
+    Refuses images whose header declares more pixels than the budget allows.
+    Carriers must fit MAX_CARRIER_PIXELS; other images only need to fit
+    MAX_DECODE_PIXELS because effects downscale them to MAX_EFFECT_PIXELS.
+    """
+    width, height = image_size(image_bytes)
+    limit = MAX_CARRIER_PIXELS if carrier else MAX_DECODE_PIXELS
+    if width * height > limit:
+        raise IngestError(
+            f"❌ Image is {width}x{height} ({width * height / 1e6:.0f} MP); "
+            f"the limit{' for hidden messages' if carrier else ''} is {limit / 1e6:.0f} MP."
+        )
+    return width, height
+
+
+async def read_image_attachment(attachment, *, carrier: bool = False) -> bytes:
+    """
+    Downloads an image attachment after checking its size, then checks the
+    declared dimensions before anything decodes it. Raises IngestError.
+    """
+    if attachment.size > MAX_UPLOAD_BYTES:
+        raise IngestError(
+            f"❌ That file is {attachment.size / 1024 / 1024:.1f} MiB; "
+            f"the limit is {MAX_UPLOAD_BYTES / 1024 / 1024:.0f} MiB."
+        )
+
+    image_bytes = await attachment.read()
+    check_image(image_bytes, carrier=carrier)
+    return image_bytes
+
+
+def open_for_effect(image_bytes: bytes | RawFrame, max_pixels: int = MAX_EFFECT_PIXELS) -> Image.Image:
+    """
+    Decodes an image for a visual-only effect, downscaled to at most `max_pixels`.
+    Image.thumbnail() lets the JPEG decoder scale while decoding (Image.draft),
+    so the full-size frame is never allocated; other formats are reduced right
+    after decoding. A RawFrame from decode_for_effect() is used as-is.
+    """
+    if isinstance(image_bytes, RawFrame):
+        return Image.frombytes(*image_bytes)
+
+    img = Image.open(io.BytesIO(image_bytes))
+    pixels = img.width * img.height
+    if pixels > max_pixels:
+        scale = math.sqrt(max_pixels / pixels)
+        img.thumbnail((max(1, int(img.width * scale)), max(1, int(img.height * scale))))
+    return img if img.mode == "RGB" else img.convert("RGB")
+
+
+def decode_for_effect(image_bytes: bytes, max_pixels: int = MAX_EFFECT_PIXELS) -> RawFrame:
+    """
+    open_for_effect() as a RawFrame, for callers that apply several effects to one upload.
+    """
+    with open_for_effect(image_bytes, max_pixels) as img:
+        return RawFrame(img.mode, img.size, img.tobytes())
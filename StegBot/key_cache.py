@@ -0,0 +1,124 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Seconds a looked-up public key is served from memory
+KEY_CACHE_TTL = float(os.getenv("KEY_CACHE_TTL", "300"))
+# Most users whose public keys are kept in memory
+KEY_CACHE_SIZE = int(os.getenv("KEY_CACHE_SIZE", "1024"))
+
+
+class PublicKeyCache:
+    """
+    TTL + LRU cache of public keys by user ID, for the event loop.
+    Users without a key are cached too (as None), so repeated lookups of
+    someone who hasn't run /generate_keys don't hit the database either.
+
+    Concurrent misses for the same user share one query. invalidate() must
+    be called whenever a user's keys change; a query that was already
+    running when that happened doesn't get to cache its (stale) result.
+    """
+
+    def __init__(self, ttl: float = KEY_CACHE_TTL, size: int = KEY_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self._entries = OrderedDict()  # user_id -> (public key or None, expires at)
+        self._pending = {}  # user_id -> task running the query
+        self._generation = {}  # user_id -> bumped by invalidate()
+        self.hits = self.misses = self.coalesced = 0
+
+    async def get(self, user_id: int, load):
+        """
+        Public key hex for `user_id`, or None if they have no keys.
+        `load` is a coroutine function that queries the database on a miss.
+        """
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            if entry[1] > time.monotonic():
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            del self._entries[user_id]
+
+        task = self._pending.get(user_id)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._load(user_id, load))
+            self._pending[user_id] = task
+        # One caller giving up mustn't cancel the query the others are waiting on
+        return await asyncio.shield(task)
+
+    async def get_many(self, user_ids: list[int], load_many) -> dict:
+        """
+        {user_id: public key hex or None} for every one of `user_ids`.
+        `load_many` is a coroutine function taking the list of missed user
+        IDs and returning {user_id: public key} for those that have one, so
+        all misses cost a single query.
+        """
+        found, waiting, missing = {}, {}, []
+        now = time.monotonic()
+        for user_id in dict.fromkeys(user_ids):
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                found[user_id] = entry[0]
+            elif user_id in self._pending:
+                self.coalesced += 1
+                waiting[user_id] = self._pending[user_id]
+            else:
+                missing.append(user_id)
+
+        if missing:
+            self.misses += len(missing)
+            generations = {user_id: self._generation.get(user_id, 0) for user_id in missing}
+            loaded = await load_many(missing)
+            for user_id in missing:
+                found[user_id] = loaded.get(user_id)
+                if self._generation.get(user_id, 0) == generations[user_id]:
+                    self._put(user_id, found[user_id])
+
+        for user_id, task in waiting.items():
+            found[user_id] = await asyncio.shield(task)
+        return found
+
+    async def _load(self, user_id: int, load):
+        generation = self._generation.get(user_id, 0)
+        try:
+            value = await load()
+        finally:
+            if self._pending.get(user_id) is asyncio.current_task():
+                del self._pending[user_id]
+        if self._generation.get(user_id, 0) == generation:
+            self._put(user_id, value)
+        return value
+
+    def _put(self, user_id: int, value):
+        self._entries[user_id] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        self._entries.pop(user_id, None)
+        self._pending.pop(user_id, None)
+        self._generation[user_id] = self._generation.get(user_id, 0) + 1
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "entries": len(self._entries),
+            "pending": len(self._pending),
+        }
+
+
+public_keys = PublicKeyCache()
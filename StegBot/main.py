@@ -1,40 +1,91 @@
 import asyncio
 import io
 import os
+import sys
+import tempfile
 
 import discord
 import binascii
-from PIL import Image
 from discord import app_commands
 from discord.ext import commands
 from dotenv import load_dotenv
 from nacl.public import PrivateKey, PublicKey, SealedBox
 from nacl.exceptions import CryptoError
 
-from database import store_user_keys, load_user_keys, init_db, get_connection  # your DB functions
+load_dotenv()
+# Modules shared with CryptoCompanion live in ../shared
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import (  # your DB functions
+    store_user_keys,
+    load_public_key,
+    load_public_keys,
+    load_private_key,
+    delete_user_keys,
+    list_public_keys_page,
+    export_public_keys,
+    init_db,
+    verify_db_ready,
+    key_store
+)
 from steg_helpers import (
     scrub_image_metadata,
     sanitize_image,
     steg_scrub_and_mutate,
-    apply_matrix_style_effect,
-    watermark_image,
-    lsb_encode,
-    lsb_decode
+    matrixify_and_watermark,
+    hide_payload_in_image,
+    read_hidden_payload,
+    plan_depth,
+    MAX_LSB_DEPTH
 )
+from batch import BatchResult, batch_summary, chunk_files, collect_images, drop_oversized, is_image, run_batch
+from envelope import decrypt_message, encrypt_for_recipients, pack_envelope
+from fanout import STEG_MAX_RECIPIENTS, fan_out, parse_user_ids
+from image_encoder import DISCORD_UPLOAD_LIMIT, encoder_settings, image_extension
+from key_cache import public_keys
+from metrics import registry, start_metrics_server
+from payload_detector import LEGACY_MIN_CHARS, scan_hidden_payload
+from ingest import IngestError, MAX_EFFECT_PIXELS, decode_for_effect, image_size, read_image_attachment
+from result_cache import cache as result_cache
+from view_state import ViewState, view_states
+from watermark import warm_watermark_cache
+from worker_pool import pool, interaction_deadline
+from shared.admission import admission_controlled, scheduler
+from shared.transport import MESSAGE_FILENAME, Packed, compress, open_packed
 
-load_dotenv()
 TOKEN = os.getenv("DISCORD_TOKEN_CC")
 KEY_RING_PASS = os.getenv("KEY_RING_PASS")
 DELETE_GPG_KEY_PASS = os.getenv("DELETE_GPG_KEY_PASS")
 
+registry.gauges("stegbot_scheduler", "Admission control for heavy commands", scheduler.stats)
+
 intents = discord.Intents.default()
 bot = commands.Bot(command_prefix="!", intents=intents)
 
 async def async_store_user_keys(user_id: int, public_key_hex: str, private_key_hex: str):
     await asyncio.to_thread(store_user_keys, user_id, public_key_hex, private_key_hex)
+    public_keys.invalidate(user_id)
 
-async def async_load_user_keys(user_id: int):
-    return await asyncio.to_thread(load_user_keys, user_id)
+async def async_load_public_key(user_id: int) -> str | None:
+    # Cached, and concurrent lookups for one user share a single query
+    return await public_keys.get(user_id, lambda: asyncio.to_thread(load_public_key, user_id))
+
+async def async_load_public_keys(user_ids: list[int]) -> dict:
+    # Cache hits cost nothing; every miss is fetched in one query
+    return await public_keys.get_many(user_ids, lambda missing: asyncio.to_thread(load_public_keys, missing))
+
+async def async_load_private_key(user_id: int) -> str | None:
+    # Never cached; only load it right before decrypting something
+    return await asyncio.to_thread(load_private_key, user_id)
+
+async def async_delete_user_keys(user_id: int) -> bool:
+    try:
+        return await asyncio.to_thread(delete_user_keys, user_id)
+    finally:
+        public_keys.invalidate(user_id)
+
+async def async_list_public_keys_page(after: str | None, limit: int):
+    return await asyncio.to_thread(list_public_keys_page, after, limit)
 
 @bot.event
 async def on_ready():
@@ -63,17 +114,15 @@ async def generate_keys(interaction: discord.Interaction):
 
 @bot.tree.command(name="list_keys", description="View your stored public key.")
 async def list_keys(interaction: discord.Interaction):
-    user_keys = await async_load_user_keys(interaction.user.id)
+    pub = await async_load_public_key(interaction.user.id)
 
-    if not user_keys:
+    if not pub:
         await interaction.response.send_message(
             "❌ You don't have a keypair stored. Run `/generate_keys` first.",
             ephemeral=True
         )
         return
 
-    pub = user_keys["public_key"]
-
     await interaction.response.send_message(
         f"🔑 **Your Public Key:**\n`{pub}`",
         ephemeral=True
@@ -82,16 +131,14 @@ async def list_keys(interaction: discord.Interaction):
 @bot.tree.command(name="lookup_key", description="Get someone else's public key.")
 @app_commands.describe(user="The user to look up")
 async def lookup_key(interaction: discord.Interaction, user: discord.User):
-    user_keys = await async_load_user_keys(user.id)
+    pub = await async_load_public_key(user.id)
 
-    if not user_keys:
+    if not pub:
         await interaction.response.send_message(
             f"❌ {user.mention} has not generated a key yet.",
             ephemeral=True
         )
         return
-
-    pub = user_keys["public_key"]
     await interaction.response.send_message(
         f"🔎 **Public Key for {user.mention}:**\n`{pub}`",
         ephemeral=True
@@ -104,38 +151,113 @@ async def delete_keys(interaction: discord.Interaction, password: str):
         await interaction.response.send_message("❌ Invalid password.", ephemeral=True)
         return
 
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM user_keys WHERE user_id = %s", (interaction.user.id,))
-    conn.commit()
-    conn.close()
+    await async_delete_user_keys(interaction.user.id)
 
     await interaction.response.send_message("🗑️ Your keypair has been deleted.", ephemeral=True)
 
+# Keys per /keyring page; keeps a page well under Discord's 2000-character limit
+KEYRING_PAGE_SIZE = 15
+
+class KeyringView(discord.ui.View):
+    """
+    Pages through the keyring in user_id order, fetching one page per click.
+    Each page starts after the last user_id of the page before it, so no
+    page ever skips over rows in the database.
+    """
+
+    def __init__(self):
+        super().__init__(timeout=300)
+        self.cursors = [None]  # start cursor of every page up to the current one
+        self.rows = []
+        self.has_next = False
+
+    async def load(self):
+        rows = await async_list_public_keys_page(self.cursors[-1], KEYRING_PAGE_SIZE + 1)
+        self.rows = rows[:KEYRING_PAGE_SIZE]
+        self.has_next = len(rows) > KEYRING_PAGE_SIZE
+        self.previous_page.disabled = len(self.cursors) == 1
+        self.next_page.disabled = not self.has_next
+
+    def render(self) -> str:
+        if not self.rows:
+            return "📭 No keys stored yet."
+        lines = "\n".join(f"<@{uid}> — `{pub}`" for uid, pub in self.rows)
+        return f"🧾 **Keyring** (page {len(self.cursors)}):\n{lines}"
+
+    @discord.ui.button(label="◀ Previous", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.cursors.pop()
+        await self.load()
+        await interaction.response.edit_message(content=self.render(), view=self)
+
+    @discord.ui.button(label="Next ▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.cursors.append(self.rows[-1][0])
+        await self.load()
+        await interaction.response.edit_message(content=self.render(), view=self)
+
 @bot.tree.command(name="keyring", description="List all users with stored public keys.")
-@app_commands.describe(password="Password to access keyring")
-async def keyring(interaction: discord.Interaction, password: str):
+@app_commands.describe(password="Password to access keyring", export="Send the whole keyring as a CSV file instead")
+async def keyring(interaction: discord.Interaction, password: str, export: bool = False):
     if password != KEY_RING_PASS:
         await interaction.response.send_message("❌ Invalid password.", ephemeral=True)
         return
 
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT user_id, public_key FROM user_keys")
-    rows = cursor.fetchall()
-    conn.close()
-
-    if not rows:
-        await interaction.response.send_message("📭 No keys stored yet.", ephemeral=True)
+    if export:
+        await interaction.response.defer(thinking=True, ephemeral=True)
+        # Streamed page by page into a temp file, so the table is never held in memory
+        with tempfile.TemporaryFile() as fp:
+            count = await asyncio.to_thread(export_public_keys, fp)
+            if fp.tell() > DISCORD_UPLOAD_LIMIT:
+                await interaction.followup.send(
+                    f"❌ The export is {fp.tell() / 1024 / 1024:.1f} MiB, over the upload limit.", ephemeral=True
+                )
+                return
+            fp.seek(0)
+            await interaction.followup.send(
+                f"🧾 Exported {count} public key{'s' if count != 1 else ''}.",
+                file=discord.File(fp, filename="keyring.csv"),
+                ephemeral=True
+            )
         return
 
-    content = "🧾 **Keyring:**\n" + "\n".join(f"<@{uid}> — `{pub}`" for uid, pub in rows)
-    await interaction.response.send_message(content, ephemeral=True)
+    view = KeyringView()
+    await view.load()
+    if view.has_next:
+        await interaction.response.send_message(view.render(), view=view, ephemeral=True)
+    else:
+        await interaction.response.send_message(view.render(), ephemeral=True)
+
+# Menu choice -> (worker task, task kwargs, result label)
+MENU_ACTIONS = {
+    "Strip Metadata": (scrub_image_metadata, {}, "🧼 Metadata stripped"),
+    "Scramble Metadata": (sanitize_image, {"scramble_metadata": True}, "🔀 Metadata scrambled"),
+    "Matrixify + Watermark": (matrixify_and_watermark, {}, "💚 Matrix effect applied"),
+    "Full Mutation Pipeline": (steg_scrub_and_mutate, {}, "🎲 Full mutation complete"),
+}
+# Choices with deterministic output; "Scramble Metadata" is random and never cached
+CACHED_CHOICES = {"Strip Metadata", "Matrixify + Watermark", "Full Mutation Pipeline"}
+# Choices whose task takes the menu's decoded frame instead of the upload bytes
+FRAME_CHOICES = {"Matrixify + Watermark", "Full Mutation Pipeline"}
+
+def action_cache_key(choice: str, digest: str) -> str | None:
+    """
+    Result cache key for a menu choice on an upload with this digest, or None if the choice isn't cacheable.
+    """
+    if choice not in CACHED_CHOICES:
+        return None
+    return result_cache.key(digest, choice, max_pixels=MAX_EFFECT_PIXELS, encoder=encoder_settings())
 
 class StegImageMenu(discord.ui.View):
-    def __init__(self, image_bytes: bytes):
+    def __init__(self, state: ViewState):
         super().__init__(timeout=60)
-        self.image_bytes = image_bytes
+        self.state = state
+
+    async def on_timeout(self):
+        self.state.release()
+
+    async def decode_frame(self, image_bytes: bytes):
+        return await pool.run(decode_for_effect, image_bytes)
 
     @discord.ui.select(
         placeholder="Choose how to process your image...",
@@ -146,36 +268,42 @@ class StegImageMenu(discord.ui.View):
             discord.SelectOption(label="Full Mutation Pipeline", description="Scrub, distort, watermark"),
         ]
     )
+    @admission_controlled
     async def select_callback(self, interaction: discord.Interaction, select: discord.ui.Select):
         choice = select.values[0]
-        await interaction.response.defer(thinking=True, ephemeral=True)
+        deadline = interaction_deadline(interaction)
+        task, options, label = MENU_ACTIONS[choice]
 
         try:
-            if choice == "Strip Metadata":
-                result = scrub_image_metadata(self.image_bytes)
-                label = "🧼 Metadata stripped"
-            elif choice == "Scramble Metadata":
-                result = sanitize_image(self.image_bytes, scramble_metadata=True)
-                label = "🔀 Metadata scrambled"
-            elif choice == "Matrixify + Watermark":
-                img = Image.open(io.BytesIO(self.image_bytes)).convert("RGB")
-                img = apply_matrix_style_effect(img)
-                img = watermark_image(img)
-                buf = io.BytesIO()
-                img.save(buf, format="PNG")
-                buf.seek(0)
-                result = buf.read()
-                label = "💚 Matrix effect applied"
-            else:  # Full Mutation
-                result = steg_scrub_and_mutate(self.image_bytes)
-                label = "🎲 Full mutation complete"
-
-            file = discord.File(io.BytesIO(result), filename="processed.png")
+            result = cache_key = None
+            if choice in CACHED_CHOICES:
+                if self.state.digest is None:
+                    self.state.digest = await asyncio.to_thread(result_cache.digest, await self.state.image_bytes())
+                cache_key = action_cache_key(choice, self.state.digest)
+                result = await asyncio.to_thread(result_cache.get, cache_key)
+
+            if result is None:
+                if choice in FRAME_CHOICES:
+                    # Decoded once per menu and reused by every effect selection
+                    source = await self.state.get_frame(self.decode_frame)
+                else:
+                    source = await self.state.image_bytes()
+                result = await pool.run(task, source, deadline=deadline, **options)
+                if cache_key is not None:
+                    await asyncio.to_thread(result_cache.put, cache_key, result)
+
+            file = discord.File(io.BytesIO(result), filename=f"processed.{image_extension(result)}")
             await interaction.followup.send(label, file=file, ephemeral=True)
 
         except Exception as e:
             await interaction.followup.send(f"❌ Failed to process image: {e}", ephemeral=True)
 
+    @discord.ui.button(label="Done", style=discord.ButtonStyle.secondary)
+    async def done_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.state.release()
+        self.stop()
+        await interaction.response.edit_message(content="✅ Done. The uploaded image has been discarded.", view=None)
+
 # Slash command
 @bot.tree.command(name="steg_image", description="Upload an image and apply steganographic filters.")
 @app_commands.describe(attachment="The image to transform")
@@ -184,20 +312,140 @@ async def steg_image(interaction: discord.Interaction, attachment: discord.Attac
         await interaction.response.send_message("❌ Please upload a valid image file.", ephemeral=True)
         return
 
-    image_bytes = await attachment.read()
+    try:
+        image_bytes = await read_image_attachment(attachment)
+    except IngestError as e:
+        await interaction.response.send_message(str(e), ephemeral=True)
+        return
+
     await interaction.response.send_message(
         "📷 Select how you'd like to process your image:",
-        view=StegImageMenu(image_bytes),
+        view=StegImageMenu(await view_states.create(image_bytes)),
         ephemeral=True
     )
 
+async def send_batch_results(interaction: discord.Interaction, results: list[BatchResult], done: str, suffix: str):
+    """
+    Sends the processed files of a batch as followups, as few as Discord's
+    per-message file count and size limits allow, with a summary on the first.
+    Outputs too large to upload are listed as failures.
+    """
+    results = drop_oversized(results)
+    files = []
+    for result in results:
+        if result.data is not None:
+            stem = os.path.splitext(result.name)[0]
+            files.append((f"{stem}_{suffix}.{image_extension(result.data)}", result.data))
+
+    content = batch_summary(results, done)
+    for chunk in chunk_files(files) or [[]]:
+        await interaction.followup.send(
+            content,
+            files=[discord.File(io.BytesIO(data), filename=name) for name, data in chunk],
+            ephemeral=True
+        )
+        content = None
+
+@bot.tree.command(name="steg_batch", description="Apply a steganographic filter to several images at once.")
+@app_commands.describe(
+    action="What to do with every image",
+    attachment="Image to transform",
+    attachment2="Another image",
+    attachment3="Another image",
+    attachment4="Another image",
+    attachment5="Another image",
+    message_link="Link to (or ID of) a message in this channel whose images should be processed too"
+)
+@app_commands.choices(action=[app_commands.Choice(name=choice, value=choice) for choice in MENU_ACTIONS])
+@admission_controlled
+async def steg_batch(interaction: discord.Interaction, action: app_commands.Choice[str],
+                     attachment: discord.Attachment | None = None, attachment2: discord.Attachment | None = None,
+                     attachment3: discord.Attachment | None = None, attachment4: discord.Attachment | None = None,
+                     attachment5: discord.Attachment | None = None, message_link: str | None = None):
+    choice = action.value
+    task, options, label = MENU_ACTIONS[choice]
+    deadline = interaction_deadline(interaction)
+
+    async def process(image):
+        image_bytes = await read_image_attachment(image)
+        cache_key = action_cache_key(choice, await asyncio.to_thread(result_cache.digest, image_bytes))
+        if cache_key is not None:
+            result = await asyncio.to_thread(result_cache.get, cache_key)
+            if result is not None:
+                return result
+        result = await pool.run(task, image_bytes, deadline=deadline, **options)
+        if cache_key is not None:
+            await asyncio.to_thread(result_cache.put, cache_key, result)
+        return result
+
+    try:
+        images = await collect_images(interaction, [attachment, attachment2, attachment3, attachment4, attachment5], message_link)
+        results = await run_batch(images, process)
+        await send_batch_results(interaction, results, f"{label} for", "processed")
+    except IngestError as e:
+        await interaction.followup.send(str(e), ephemeral=True)
+    except Exception as e:
+        await interaction.followup.send(f"❌ Failed to process images: {e}", ephemeral=True)
+
+async def resolve_recipients(to_user: discord.User, also_to: str | None) -> tuple[dict[int, str], list[int]]:
+    """
+    ({user_id: public key hex} for every recipient with keys, in the order
+    given; IDs of the recipients without keys). Raises ValueError if there
+    are more than STEG_MAX_RECIPIENTS.
+    """
+    user_ids = list(dict.fromkeys([to_user.id] + parse_user_ids(also_to)))
+    if len(user_ids) > STEG_MAX_RECIPIENTS:
+        raise ValueError(f"❌ That's {len(user_ids)} recipients; the most is {STEG_MAX_RECIPIENTS}.")
+    keys = await async_load_public_keys(user_ids)
+    return {uid: keys[uid] for uid in user_ids if keys.get(uid)}, [uid for uid in user_ids if not keys.get(uid)]
+
+def seal_for_recipients(message: bytes, keys: dict[int, str]) -> bytes:
+    """
+    A plain SealedBox for one recipient (readable by older versions of the
+    bot); otherwise one envelope that every recipient can open.
+    """
+    if len(keys) == 1:
+        return SealedBox(PublicKey(bytes.fromhex(next(iter(keys.values()))))).encrypt(message)
+    return pack_envelope(*encrypt_for_recipients(message, [bytes.fromhex(key) for key in keys.values()]))
+
+def delivery_report(first_line: str, failures: list, skipped: list[int]) -> str:
+    lines = [first_line]
+    for user_id, error in failures:
+        reason = "their DMs are closed" if isinstance(error, discord.Forbidden) else str(error)
+        lines.append(f"⚠️ <@{user_id}>: {reason}")
+    if skipped:
+        lines.append("⚠️ No keys yet, skipped: " + ", ".join(f"<@{user_id}>" for user_id in skipped))
+    return "\n".join(lines)[:2000]
+
+async def send_dm(user_id: int, content: str, file_bytes: bytes | None = None, filename: str | None = None):
+    channel = await bot.create_dm(discord.Object(id=user_id))
+    file = discord.File(fp=io.BytesIO(file_bytes), filename=filename) if file_bytes is not None else None
+    await channel.send(content, file=file)
+
+async def send_ciphertext(user_id: int, heading: str, packed: Packed):
+    """
+    DMs an encrypted message as armored text, or as a file when it's too long for a message.
+    """
+    if packed.fits_inline():
+        await send_dm(user_id, f"{heading}:\n```\n{packed.text()}\n```")
+    else:
+        await send_dm(user_id, f"{heading} (attached; run /decrypt with the file).", packed.file_bytes(), MESSAGE_FILENAME)
+
 @bot.tree.command(name="encrypt", description="Encrypt a message for another user (message will be entered privately).")
-@app_commands.describe(to_user="User to encrypt message for")
-async def encrypt(interaction: discord.Interaction, to_user: discord.User):
-    recipient_keys = await async_load_user_keys(to_user.id)
-    if not recipient_keys:
+@app_commands.describe(
+    to_user="User to encrypt message for",
+    also_to="More recipients (mentions or user IDs); the message is encrypted once for everyone"
+)
+async def encrypt(interaction: discord.Interaction, to_user: discord.User, also_to: str | None = None):
+    try:
+        keys, skipped = await resolve_recipients(to_user, also_to)
+    except ValueError as e:
+        await interaction.response.send_message(str(e), ephemeral=True)
+        return
+    if not keys:
         await interaction.response.send_message(
-            "❌ That user has not generated keys yet. Ask them to run /generate_keys.",
+            "❌ That user has not generated keys yet. Ask them to run /generate_keys." if not also_to
+            else "❌ None of those users have generated keys yet. Ask them to run /generate_keys.",
             ephemeral=True
         )
         return
@@ -206,189 +454,297 @@ async def encrypt(interaction: discord.Interaction, to_user: discord.User):
         message = discord.ui.TextInput(label="Message", style=discord.TextStyle.paragraph)
 
         async def on_submit(self, modal_interaction: discord.Interaction):
-            recipient_pub_key = PublicKey(bytes.fromhex(recipient_keys["public_key"]))
-            sealed_box = SealedBox(recipient_pub_key)
-            encrypted = sealed_box.encrypt(self.message.value.encode())
-
-            try:
-                await to_user.send(
-                    f"🔒 Encrypted message from {interaction.user.mention}:\n```\n{encrypted.hex()}\n```"
-                )
-                await modal_interaction.response.send_message(
-                    f"✅ Encrypted message delivered to {to_user.mention}'s DMs.",
-                    ephemeral=True
+            # Pacing a big fan-out can take longer than an interaction response may
+            await modal_interaction.response.defer(thinking=True, ephemeral=True)
+            codec, message = compress(self.message.value.encode())
+
+            if len(keys) == 1:
+                ciphertexts = dict.fromkeys(keys, seal_for_recipients(message, keys))
+            else:
+                # Encrypted once; each DM carries the shared ciphertext and only its recipient's key slot
+                slots, body = encrypt_for_recipients(message, [bytes.fromhex(key) for key in keys.values()])
+                ciphertexts = {uid: pack_envelope([slot], body) for uid, slot in zip(keys, slots)}
+
+            async def send(user_id: int):
+                await send_ciphertext(
+                    user_id, f"🔒 Encrypted message from {interaction.user.mention}", Packed(codec, ciphertexts[user_id])
                 )
-            except discord.Forbidden:
-                await modal_interaction.response.send_message(
-                    "❌ Couldn't send DM to that user. They might have DMs disabled.",
-                    ephemeral=True
+
+            failures = await fan_out(list(keys), send)
+
+            if len(keys) == 1 and not skipped:
+                if failures:
+                    text = "❌ Couldn't send DM to that user. They might have DMs disabled."
+                else:
+                    text = f"✅ Encrypted message delivered to {to_user.mention}'s DMs."
+            else:
+                text = delivery_report(
+                    f"✅ Encrypted message delivered to {len(keys) - len(failures)} of {len(keys) + len(skipped)} recipients' DMs.",
+                    failures, skipped
                 )
+            await modal_interaction.followup.send(text, ephemeral=True)
 
     await interaction.response.send_modal(EncryptModal())
 
 @bot.tree.command(name="decrypt", description="Decrypt an encrypted message.")
-@app_commands.describe(ciphertext="Encrypted message in hex")
-async def decrypt(interaction: discord.Interaction, ciphertext: str):
-    user_keys = await async_load_user_keys(interaction.user.id)
-    if not user_keys:
-        await interaction.response.send_message(
-            "❌ You don't have a keypair. Run /generate_keys first.",
-            ephemeral=True
-        )
+@app_commands.describe(
+    ciphertext="Encrypted message as it was sent (older hex messages work too)",
+    attachment="The encrypted message file, for messages too long to send as text"
+)
+async def decrypt(interaction: discord.Interaction, ciphertext: str | None = None, attachment: discord.Attachment | None = None):
+    await interaction.response.defer(thinking=True, ephemeral=True)
+
+    if ciphertext is None and attachment is None:
+        await interaction.followup.send("❌ Paste the encrypted message or attach its file.", ephemeral=True)
+        return
+    if attachment is not None and attachment.size > DISCORD_UPLOAD_LIMIT:
+        await interaction.followup.send("❌ That file is too large to be an encrypted message.", ephemeral=True)
+        return
+
+    private_key_hex = await async_load_private_key(interaction.user.id)
+    if not private_key_hex:
+        await interaction.followup.send("❌ You don't have a keypair. Run /generate_keys first.", ephemeral=True)
         return
 
-    private_key = PrivateKey(bytes.fromhex(user_keys["private_key"]))
-    sealed_box = SealedBox(private_key)
+    private_key = PrivateKey(bytes.fromhex(private_key_hex))
 
     try:
-        decrypted = sealed_box.decrypt(bytes.fromhex(ciphertext))
-        plaintext = decrypted.decode()
-        await interaction.response.send_message(
-            f"✅ Decrypted message:\n```\n{plaintext}\n```",
-            ephemeral=True
-        )
+        # Armored text, an attached message file, or hex from older messages
+        data = await attachment.read() if attachment is not None else ciphertext
+        plaintext = open_packed(data, lambda c: decrypt_message(c, private_key)).decode()
+        if len(plaintext) > 1900:
+            file = discord.File(fp=io.BytesIO(plaintext.encode()), filename="message.txt")
+            await interaction.followup.send("✅ Decrypted message (attached, too long to show):", file=file, ephemeral=True)
+        else:
+            await interaction.followup.send(f"✅ Decrypted message:\n```\n{plaintext}\n```", ephemeral=True)
     except Exception as e:
-        await interaction.response.send_message(
-            f"❌ Failed to decrypt: {str(e)}",
-            ephemeral=True
-        )
+        await interaction.followup.send(f"❌ Failed to decrypt: {str(e)}", ephemeral=True)
 
 @bot.tree.command(name="hide_message", description="Encrypt a message and hide it inside an image.")
-@app_commands.describe(to_user="Recipient user", message="Message to hide", attachment="Image to hide message in")
-async def hide_message(interaction: discord.Interaction, to_user: discord.User, message: str, attachment: discord.Attachment):
-    recipient_keys = await async_load_user_keys(to_user.id)
-    if not recipient_keys:
-        await interaction.response.send_message("❌ That user has not generated keys yet. Ask them to run /generate_keys.", ephemeral=True)
+@app_commands.describe(
+    to_user="Recipient user",
+    message="Message to hide",
+    attachment="Image to hide message in",
+    bit_depth="Bits per colour channel (1-3); more fits larger messages in small images. Default: smallest that fits",
+    also_to="More recipients (mentions or user IDs); all of them can reveal the same image",
+    dm_recipients="Also DM the image to every recipient"
+)
+@admission_controlled
+async def hide_message(interaction: discord.Interaction, to_user: discord.User, message: str, attachment: discord.Attachment,
+                       bit_depth: app_commands.Range[int, 1, MAX_LSB_DEPTH] | None = None,
+                       also_to: str | None = None, dm_recipients: bool = False):
+    try:
+        keys, skipped = await resolve_recipients(to_user, also_to)
+    except ValueError as e:
+        await interaction.followup.send(str(e), ephemeral=True)
+        return
+    if not keys:
+        await interaction.followup.send(
+            "❌ That user has not generated keys yet. Ask them to run /generate_keys." if not also_to
+            else "❌ None of those users have generated keys yet. Ask them to run /generate_keys.",
+            ephemeral=True
+        )
         return
 
     try:
-        # Read image bytes
-        image_bytes = await attachment.read()
+        # Read image bytes (refused up front if the carrier is over budget)
+        image_bytes = await read_image_attachment(attachment, carrier=True)
 
-        # Encrypt message
-        recipient_pub_key = PublicKey(bytes.fromhex(recipient_keys["public_key"]))
-        sealed_box = SealedBox(recipient_pub_key)
-        encrypted = sealed_box.encrypt(message.encode())
+        # Encrypt message (once, however many recipients share the carrier)
+        encrypted = seal_for_recipients(message.encode(), keys)
 
-        # Load image and embed encrypted message
-        img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-        img_with_data = lsb_encode(img, encrypted.hex())  # encode hex string
+        # Refuse messages that won't fit before any pixels are decoded
+        width, height = image_size(image_bytes)
+        try:
+            depth = plan_depth(width, height, len(encrypted), bit_depth)
+        except ValueError as e:
+            await interaction.followup.send(f"❌ Message too large for this image. {e}", ephemeral=True)
+            return
 
-        # Save modified image to bytes
-        output = io.BytesIO()
-        img_with_data.save(output, format="PNG")
-        output.seek(0)
+        # Embed the raw ciphertext in a length-prefixed container (in a worker process)
+        carrier = await pool.run(hide_payload_in_image, image_bytes, encrypted, depth, deadline=interaction_deadline(interaction))
 
-        file = discord.File(fp=output, filename="hidden_message.png")
-        await interaction.response.send_message(f"✅ Message encrypted and hidden inside the image for {to_user.mention}.", file=file, ephemeral=True)
+        failures = []
+        if dm_recipients:
+            note = f"🖼️ {interaction.user.mention} hid a message for you in this image. Use /reveal_message to read it."
+            failures = await fan_out(list(keys), lambda user_id: send_dm(user_id, note, carrier, "hidden_message.png"))
 
+        if len(keys) == 1 and not skipped and not failures:
+            text = f"✅ Message encrypted and hidden inside the image for {to_user.mention}."
+        else:
+            text = delivery_report(
+                f"✅ Message encrypted and hidden inside the image for {len(keys)} recipient{'s' if len(keys) != 1 else ''}"
+                + (f"; DMed to {len(keys) - len(failures)} of them." if dm_recipients else "."),
+                failures, skipped
+            )
+        file = discord.File(fp=io.BytesIO(carrier), filename="hidden_message.png")
+        await interaction.followup.send(text, file=file, ephemeral=True)
+
+    except IngestError as e:
+        await interaction.followup.send(str(e), ephemeral=True)
     except Exception as e:
-        await interaction.response.send_message(f"❌ Failed to hide message: {e}", ephemeral=True)
+        await interaction.followup.send(f"❌ Failed to hide message: {e}", ephemeral=True)
+
+@bot.tree.command(name="hide_message_batch", description="Encrypt a message and hide it inside several images.")
+@app_commands.describe(
+    to_user="Recipient user",
+    message="Message to hide in every image",
+    attachment="Image to hide the message in",
+    attachment2="Another image",
+    attachment3="Another image",
+    attachment4="Another image",
+    attachment5="Another image",
+    message_link="Link to (or ID of) a message in this channel whose images should be used too",
+    bit_depth="Bits per colour channel (1-3). Default: smallest that fits each image"
+)
+@admission_controlled
+async def hide_message_batch(interaction: discord.Interaction, to_user: discord.User, message: str,
+                             attachment: discord.Attachment | None = None, attachment2: discord.Attachment | None = None,
+                             attachment3: discord.Attachment | None = None, attachment4: discord.Attachment | None = None,
+                             attachment5: discord.Attachment | None = None, message_link: str | None = None,
+                             bit_depth: app_commands.Range[int, 1, MAX_LSB_DEPTH] | None = None):
+    recipient_key = await async_load_public_key(to_user.id)
+    if not recipient_key:
+        await interaction.followup.send("❌ That user has not generated keys yet. Ask them to run /generate_keys.", ephemeral=True)
+        return
+
+    # Encrypted once; every carrier holds the same ciphertext
+    encrypted = SealedBox(PublicKey(bytes.fromhex(recipient_key))).encrypt(message.encode())
+    deadline = interaction_deadline(interaction)
+
+    async def process(image):
+        image_bytes = await read_image_attachment(image, carrier=True)
+        width, height = image_size(image_bytes)
+        depth = plan_depth(width, height, len(encrypted), bit_depth)  # too small -> reported for this image
+        return await pool.run(hide_payload_in_image, image_bytes, encrypted, depth, deadline=deadline)
+
+    try:
+        images = await collect_images(interaction, [attachment, attachment2, attachment3, attachment4, attachment5], message_link)
+        results = await run_batch(images, process)
+        await send_batch_results(interaction, results, f"✅ Message hidden for {to_user.mention} in", "hidden")
+    except IngestError as e:
+        await interaction.followup.send(str(e), ephemeral=True)
+    except Exception as e:
+        await interaction.followup.send(f"❌ Failed to hide message: {e}", ephemeral=True)
 
 @bot.tree.command(name="reveal_message", description="Reveal and decrypt a hidden message inside an image.")
 @app_commands.describe(attachment="Image with hidden message")
+@admission_controlled
 async def reveal_message(interaction: discord.Interaction, attachment: discord.Attachment):
-    await interaction.response.defer(thinking=True, ephemeral=True)  # <-- add this first!
-
-    user_keys = await async_load_user_keys(interaction.user.id)
-    if not user_keys:
+    # The private key itself is only loaded once there is something to decrypt
+    if not await async_load_public_key(interaction.user.id):
         await interaction.followup.send("❌ You don't have a keypair. Run /generate_keys first.", ephemeral=True)
         return
 
     try:
-        # Read image bytes
-        image_bytes = await attachment.read()
+        # Read image bytes (refused up front if the carrier is over budget)
+        image_bytes = await read_image_attachment(attachment, carrier=True)
+
+        # Read the hidden payload (in a worker process)
+        encrypted_bytes, hidden_hex = await pool.run(read_hidden_payload, image_bytes, deadline=interaction_deadline(interaction))
 
-        # Load image and decode hidden hex string
-        img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-        hidden_hex = lsb_decode(img)
+        if encrypted_bytes is None:
+            # Carriers from before the container format hold a null-terminated hex string
+            encrypted_bytes = bytes.fromhex(hidden_hex) if hidden_hex else b""
 
-        if not hidden_hex:
+        if not encrypted_bytes:
             await interaction.followup.send("❌ No hidden message found in the image.", ephemeral=True)
             return
 
         # Decrypt the hidden message
-        private_key = PrivateKey(bytes.fromhex(user_keys["private_key"]))
-        sealed_box = SealedBox(private_key)
-        encrypted_bytes = bytes.fromhex(hidden_hex)
+        private_key_hex = await async_load_private_key(interaction.user.id)
+        if not private_key_hex:
+            await interaction.followup.send("❌ You don't have a keypair. Run /generate_keys first.", ephemeral=True)
+            return
+        private_key = PrivateKey(bytes.fromhex(private_key_hex))
 
-        decrypted = sealed_box.decrypt(encrypted_bytes)
+        decrypted = decrypt_message(encrypted_bytes, private_key)
         plaintext = decrypted.decode()
 
         await interaction.followup.send(f"🔓 Hidden message revealed:\n```\n{plaintext}\n```", ephemeral=True)
 
     except CryptoError:
         await interaction.followup.send("❌ Failed to decrypt hidden message. Are you the intended recipient?", ephemeral=True)
+    except IngestError as e:
+        await interaction.followup.send(str(e), ephemeral=True)
     except Exception as e:
         await interaction.followup.send(f"❌ Failed to reveal message: {e}", ephemeral=True)
 
-@bot.tree.context_menu(name="Scan for Hidden Data")
-async def scan_for_hidden_data(interaction: discord.Interaction, message: discord.Message):
-    image = next((a for a in message.attachments if a.content_type and a.content_type.startswith("image/")), None)
+def first_image(message: discord.Message) -> discord.Attachment | None:
+    return next((a for a in message.attachments if is_image(a)), None)
 
-    if not image:
-        await interaction.response.send_message("❌ No image attachment found in that message.", ephemeral=True)
-        return
+def require_image(interaction: discord.Interaction, message: discord.Message) -> str | None:
+    if not first_image(message):
+        return "❌ No image attachment found in that message."
 
-    image_bytes = await image.read()
+@bot.tree.context_menu(name="Scan for Hidden Data")
+@admission_controlled(precheck=require_image)
+async def scan_for_hidden_data(interaction: discord.Interaction, message: discord.Message):
+    image = first_image(message)
 
     try:
-        img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-        hidden_data = lsb_decode(img)
+        image_bytes = await read_image_attachment(image, carrier=True)
+        # Ordinary photos are ruled out from a small pixel sample before any full decode
+        detection, encrypted_bytes, hidden_data = await pool.run(
+            scan_hidden_payload, image_bytes, deadline=interaction_deadline(interaction)
+        )
 
-        if not hidden_data:
-            await interaction.response.send_message("📭 No hidden message found.", ephemeral=True)
+        if not encrypted_bytes and not hidden_data:
+            await interaction.followup.send(
+                f"📭 No hidden message found (detector score {detection.score:.2f}). Plaintext hidden by older "
+                f"versions of the bot isn't detected if it's under {LEGACY_MIN_CHARS} characters or uses "
+                "characters outside Latin-1.", ephemeral=True
+            )
             return
 
-        # Try hex-decode
+        # Container payloads are raw ciphertext; older carriers hold hex or plaintext
         try:
-            encrypted_bytes = bytes.fromhex(hidden_data)
+            if encrypted_bytes is None:
+                encrypted_bytes = bytes.fromhex(hidden_data)
 
-            user_keys = await async_load_user_keys(interaction.user.id)
-            if not user_keys:
-                await interaction.response.send_message("❌ You need a keypair. Run /generate_keys first.", ephemeral=True)
+            private_key_hex = await async_load_private_key(interaction.user.id)
+            if not private_key_hex:
+                await interaction.followup.send("❌ You need a keypair. Run /generate_keys first.", ephemeral=True)
                 return
 
-            private_key = PrivateKey(bytes.fromhex(user_keys["private_key"]))
-            sealed_box = SealedBox(private_key)
+            private_key = PrivateKey(bytes.fromhex(private_key_hex))
 
-            decrypted = sealed_box.decrypt(encrypted_bytes).decode()
+            decrypted = decrypt_message(encrypted_bytes, private_key).decode()
 
-            await interaction.response.send_message(f"🕵️ Hidden encrypted message:\n```\n{decrypted}\n```", ephemeral=True)
+            await interaction.followup.send(f"🕵️ Hidden encrypted message:\n```\n{decrypted}\n```", ephemeral=True)
 
         except ValueError:
             # Not valid hex – treat as plaintext
-            await interaction.response.send_message(f"📄 Hidden plaintext message:\n```\n{hidden_data}\n```", ephemeral=True)
+            await interaction.followup.send(f"📄 Hidden plaintext message:\n```\n{hidden_data}\n```", ephemeral=True)
 
         except CryptoError:
-            await interaction.response.send_message("❌ Hidden data looks like encrypted hex but couldn't be decrypted — are you the intended recipient?", ephemeral=True)
+            await interaction.followup.send("❌ Hidden data looks encrypted but couldn't be decrypted — are you the intended recipient?", ephemeral=True)
 
+    except IngestError as e:
+        await interaction.followup.send(str(e), ephemeral=True)
     except Exception as e:
-        await interaction.response.send_message(f"❌ Error scanning image: {e}", ephemeral=True)
+        await interaction.followup.send(f"❌ Error scanning image: {e}", ephemeral=True)
         
-# Similarly update encrypt_file and decrypt_file commands with async DB calls
-def verify_db_ready():
-    """
-    Checks if the expected tables exist. Returns True if ready, False if not.
-    """
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SHOW TABLES LIKE 'user_keys'")
-        result = cursor.fetchone()
-        conn.close()
-        return result is not None
-    except Exception as e:
-        print(f"⚠️ DB verification failed: {e}")
-        return False
-
 if __name__ == "__main__":
     print("🔍 Checking database status...")
     try:
         init_db()
         if verify_db_ready():
             print("✅ Database tables verified.")
-            bot.run(TOKEN)
+            pool.start(initializer=warm_watermark_cache)
+            print(f"⚙️ Started {pool.workers} image worker processes.")
+            metrics_server = start_metrics_server()
+            if metrics_server:
+                host, port = metrics_server.server_address[:2]
+                print(f"📈 Serving metrics on http://{host}:{port}/metrics")
+            try:
+                bot.run(TOKEN)
+            finally:
+                pool.shutdown()
+                if metrics_server:
+                    metrics_server.shutdown()
+                view_states.close()
+                key_store.close()
         else:
             print("❌ Table check failed. Exiting.")
     except Exception as e:
@@ -0,0 +1,104 @@
+import struct
+
+# Chunk/segment surgery for stripping metadata without decoding pixels.
+# The compressed image data is copied through untouched, so the output keeps
+# the original format and compression, and the cost is a single pass over the
+# container structure.
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Chunks that affect how the pixels decode; everything else (eXIf, iCCP,
+# tEXt/zTXt/iTXt, tIME, pHYs, ...) is dropped. acTL/fcTL/fdAT keep APNG frames.
+PNG_KEEP_CHUNKS = {b"IHDR", b"PLTE", b"tRNS", b"IDAT", b"IEND", b"acTL", b"fcTL", b"fdAT"}
+
+# APP0 (JFIF) and APP14 (Adobe colour transform) are needed to decode the
+# colours correctly; the other APPn segments carry EXIF/GPS (APP1), XMP (APP1),
+# ICC profiles (APP2), Photoshop IRBs (APP13) and the like.
+JPEG_KEEP_APP = {0xE0, 0xEE}
+JPEG_COM = 0xFE
+JPEG_SOS = 0xDA
+JPEG_EOI = b"\xff\xd9"
+# Markers without a length field
+JPEG_STANDALONE = {0x01} | set(range(0xD0, 0xD9))
+
+
+def strip_png_metadata(data: bytes) -> bytes | None:
+    """
+    Drops ancillary PNG chunks and anything after IEND.
+    Returns None if `data` isn't a well-formed PNG.
+    """
+    if not data.startswith(PNG_SIGNATURE):
+        return None
+
+    view = memoryview(data)
+    out = [PNG_SIGNATURE]
+    pos = len(PNG_SIGNATURE)
+    while pos + 8 <= len(data):
+        length, chunk_type = struct.unpack_from(">I4s", data, pos)
+        end = pos + 12 + length
+        if end > len(data):
+            return None
+        if chunk_type in PNG_KEEP_CHUNKS:
+            out.append(view[pos:end])
+        pos = end
+        if chunk_type == b"IEND":
+            return b"".join(out)
+    return None
+
+
+def strip_jpeg_metadata(data: bytes) -> bytes | None:
+    """
+    Drops APPn (except JFIF/Adobe) and COM segments, and anything after EOI.
+    Returns None if `data` isn't a well-formed JPEG.
+    """
+    if not data.startswith(b"\xff\xd8"):
+        return None
+
+    view = memoryview(data)
+    out = [b"\xff\xd8"]
+    pos = 2
+    while pos + 2 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        if marker in JPEG_STANDALONE:
+            out.append(view[pos:pos + 2])
+            pos += 2
+            continue
+        if pos + 4 > len(data):
+            return None
+        (length,) = struct.unpack_from(">H", data, pos + 2)
+        end = pos + 2 + length
+        if end > len(data):
+            return None
+
+        if marker == JPEG_SOS:
+            # Entropy-coded data never contains an unstuffed FF D9, so the first
+            # one after the first scan header is the real end of the image.
+            eoi = data.find(JPEG_EOI, end)
+            if eoi == -1:
+                return None
+            out.append(view[pos:eoi + 2])
+            return b"".join(out)
+
+        is_metadata = (0xE0 <= marker <= 0xEF and marker not in JPEG_KEEP_APP) or marker == JPEG_COM
+        if not is_metadata:
+            out.append(view[pos:end])
+        pos = end
+    return None
+
+
+def strip_metadata(data: bytes) -> bytes | None:
+    """
+    Metadata-free copy of a PNG or JPEG without decoding it.
+    Returns None for other formats or damaged files so callers can fall back
+    to a full decode and re-encode.
+    """
+    if data.startswith(PNG_SIGNATURE):
+        return strip_png_metadata(data)
+    if data.startswith(b"\xff\xd8"):
+        return strip_jpeg_metadata(data)
+    return None
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# In-memory tier budget (per process)
+STEG_CACHE_MEMORY_BYTES = int(os.getenv("STEG_CACHE_MEMORY_BYTES", str(64 * 1024 * 1024)))
+# Optional on-disk tier, shared by the bot and its worker processes
+STEG_CACHE_DIR = os.getenv("STEG_CACHE_DIR")
+STEG_CACHE_DISK_BYTES = int(os.getenv("STEG_CACHE_DISK_BYTES", str(512 * 1024 * 1024)))
+
+# Bump when an operation's output changes so stale disk entries stop matching
+# (encoder settings are part of the key already; see image_encoder.encoder_settings)
+CACHE_VERSION = 2
+
+
+class ResultCache:
+    """
+    LRU cache of processed images keyed by (SHA-256 of the input, operation,
+    parameters). Only deterministic operations belong here; anything with
+    random output (e.g. scrambled metadata) must not be cached.
+
+    Entries live in a memory tier with a byte budget and, if `disk_dir` is
+    set, in an on-disk tier with its own budget where the least recently used
+    files are evicted first.
+    """
+
+    def __init__(self, memory_bytes: int = STEG_CACHE_MEMORY_BYTES, disk_dir: str | None = None,
+                 disk_bytes: int = STEG_CACHE_DISK_BYTES):
+        self.memory_bytes = memory_bytes
+        self.disk_dir = disk_dir
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._disk_used = None
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.memory_hits = self.disk_hits = 0
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def digest(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def key(digest: str, operation: str, **params) -> str:
+        """
+        Cache key for `operation` applied to an input with the given SHA-256 digest.
+        """
+        spec = json.dumps([CACHE_VERSION, digest, operation, params], sort_keys=True)
+        return hashlib.sha256(spec.encode()).hexdigest()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return value
+
+        value = self._disk_get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+        self._memory_put(key, value)
+        return value
+
+    def put(self, key: str, value: bytes):
+        self._memory_put(key, value)
+        self._disk_put(key, value)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_used,
+            }
+
+    def _memory_put(self, key: str, value: bytes):
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_used -= len(old)
+            # One entry may not take over the whole tier; the older value is dropped either way
+            if len(value) > self.memory_bytes // 4:
+                return
+            self._memory[key] = value
+            self._memory_used += len(value)
+            while self._memory_used > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_used -= len(evicted)
+
+    def _disk_get(self, key: str) -> bytes | None:
+        if not self.disk_dir:
+            return None
+        path = os.path.join(self.disk_dir, key)
+        try:
+            with open(path, "rb") as f:
+                value = f.read()
+            os.utime(path)  # mtime doubles as the LRU clock
+            return value
+        except OSError:
+            return None
+
+    def _disk_put(self, key: str, value: bytes):
+        if not self.disk_dir or len(value) > self.disk_bytes // 4:
+            return
+        path = os.path.join(self.disk_dir, key)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            if self._disk_used is not None:
+                self._disk_used += len(value) - replaced
+            over_budget = self._disk_used is None or self._disk_used > self.disk_bytes
+        if over_budget:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        # Other processes write here too, so re-measure instead of trusting our count
+        entries = []
+        with os.scandir(self.disk_dir) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.startswith(".tmp-"):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        used = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if used <= self.disk_bytes:
+                break
+            try:
+                os.remove(path)
+                used -= size
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_used = used
+
+
+cache = ResultCache(disk_dir=STEG_CACHE_DIR)
@@ -1,23 +1,89 @@
 import io
 import random
+import struct
 import time
 
+import numpy as np
 import piexif
-from PIL import Image, ImageDraw, ImageFont, ImageEnhance, ImageFilter, ImageChops
+from PIL import Image, ImageFilter, ImageChops, ImageStat
 
+from image_encoder import encode_image, encoder_settings
+from ingest import MAX_EFFECT_PIXELS, RawFrame, open_for_effect
+from result_cache import cache
+from metadata_stripper import strip_metadata
+from watermark import WATERMARK_TEXT, stamp_watermark
 
-def apply_matrix_style_effect(img: Image.Image) -> Image.Image:
+
+class EffectPipeline:
+    """
+    Ordered chain of image stages, each timed on its own. A point stage is a
+    per-channel lookup table (256 entries for all channels or 768 for R, G, B)
+    applied with Image.point, or a callable that builds the table from the
+    image reaching it, e.g. contrast, which depends on the image mean.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.stages = []
+
+    def point(self, name: str, lut) -> "EffectPipeline":
+        self.stages.append(("point", name, lut))
+        return self
+
+    def filter(self, name: str, image_filter) -> "EffectPipeline":
+        self.stages.append(("filter", name, image_filter))
+        return self
+
+    def run(self, img: Image.Image, timings: list | None = None) -> Image.Image:
+        """
+        Runs every stage on an RGB copy of `img`.
+        If `timings` is given, (stage name, seconds) pairs are appended to it.
+        """
+        img = img if img.mode == "RGB" else img.convert("RGB")
+        for kind, name, op in self.stages:
+            started = time.perf_counter()
+            if kind == "point":
+                img = img.point(_rgb_lut(op(img) if callable(op) else op))
+            else:
+                img = img.filter(op)
+            if timings is not None:
+                timings.append((name, time.perf_counter() - started))
+        return img
+
+
+def _rgb_lut(lut) -> list:
+    lut = list(lut)
+    return lut * 3 if len(lut) == 256 else lut
+
+
+def contrast_lut(factor: float):
+    """
+    Point-stage builder equivalent to ImageEnhance.Contrast(img).enhance(factor),
+    without the grey degenerate image and the blend.
+    """
+    def build(img: Image.Image) -> list:
+        mean = int(ImageStat.Stat(img.convert("L")).mean[0] + 0.5)
+        # Same float32 arithmetic and truncation as PIL's blend
+        levels = np.float32(mean) + np.float32(factor) * (np.arange(256, dtype=np.float32) - np.float32(mean))
+        return np.clip(levels, 0, 255).astype(np.uint8).tolist()
+    return build
+
+
+MATRIX_PIPELINE = (
+    EffectPipeline("matrix")
+    .point("contrast", contrast_lut(2.5))
+    .filter("blur", ImageFilter.GaussianBlur(radius=0.4))
+    .filter("sharpen", ImageFilter.UnsharpMask(radius=2, percent=150, threshold=3))
+    .point("green_boost", list(range(256)) + [min(255, i + 60) for i in range(256)] + list(range(256)))
+)
+
+
+def apply_matrix_style_effect(img: Image.Image, timings: list | None = None) -> Image.Image:
     """
     Applies a high-contrast, green-tinted 'Matrix' visual distortion to the image.
     Includes sharpening, blur, and color enhancement.
     """
-    img = img.convert("RGB")
-    img = ImageEnhance.Contrast(img).enhance(2.5)
-    img = img.filter(ImageFilter.GaussianBlur(radius=0.4))
-    img = img.filter(ImageFilter.UnsharpMask(radius=2, percent=150, threshold=3))
-    r, g, b = img.split()
-    g = g.point(lambda i: min(255, i + 60))
-    return Image.merge("RGB", (r, g, b))
+    return MATRIX_PIPELINE.run(img, timings)
 
 def apply_glitch_effect(img: Image.Image) -> Image.Image:
     """
@@ -31,70 +97,94 @@ def apply_glitch_effect(img: Image.Image) -> Image.Image:
     img = Image.merge("RGB", (r, g, b))
     return img.filter(ImageFilter.CONTOUR)
 
-def apply_pixel_sort_effect(img: Image.Image) -> Image.Image:
+PIXEL_SORT_BAND_ROWS = 256  # rows permuted per pass; bounds the index array's memory
+
+def apply_pixel_sort_effect(img: Image.Image, *, variant: str = "shuffle", seed: int | None = None) -> Image.Image:
     """
-    Create a corrupted-pixel look by sorting rows or columns slightly.
+    Create a corrupted-pixel look by reordering the pixels of every row.
+    variant="shuffle" permutes each row randomly (pass `seed` for reproducible output);
+    variant="sort" orders each row by luminance.
     """
-    img = img.convert("RGB")
-    pixels = img.load()
-    for y in range(img.height):
-        row = [pixels[x, y] for x in range(img.width)]
-        random.shuffle(row)
-        for x in range(img.width):
-            pixels[x, y] = row[x]
-    return img
-
-def watermark_image(img: Image.Image, text="Encrypted by StegoBot") -> Image.Image:
-    draw = ImageDraw.Draw(img)
-    font_size = max(12, int(img.width * 0.03))
+    if variant not in ("shuffle", "sort"):
+        raise ValueError(f"Unknown pixel sort variant: {variant}")
 
-    try:
-        font = ImageFont.truetype("DejaVuSans.ttf", font_size)
-    except IOError:
-        font = ImageFont.load_default()
+    arr = np.array(img.convert("RGB"), dtype=np.uint8)
+    height, width = arr.shape[:2]
+    rng = np.random.default_rng(seed)
 
-    # textbbox returns (left, top, right, bottom)
-    bbox = draw.textbbox((0, 0), text, font=font)
-    text_width = bbox[2] - bbox[0]
-    text_height = bbox[3] - bbox[1]
+    for top in range(0, height, PIXEL_SORT_BAND_ROWS):
+        band = arr[top:top + PIXEL_SORT_BAND_ROWS]
+        if variant == "shuffle":
+            order = np.tile(np.arange(width, dtype=np.int32), (band.shape[0], 1))
+            order = rng.permuted(order, axis=1)
+        else:
+            # ITU-R 601 luma in integer math, same weights as PIL's "L" conversion
+            luma = band[..., 0] * np.uint32(299) + band[..., 1] * np.uint32(587) + band[..., 2] * np.uint32(114)
+            order = np.argsort(luma, axis=1, kind="stable")
+        band[:] = np.take_along_axis(band, order[..., None], axis=1)
 
-    position = (img.width - text_width - 12, img.height - text_height - 8)
-    draw.text(position, text, font=font, fill=(0, 255, 0))  # Matrix green
+    return Image.fromarray(arr, "RGB")
 
-    return img
+def watermark_image(img: Image.Image, text=WATERMARK_TEXT) -> Image.Image:
+    """
+    Stamps `text` in Matrix green into the bottom-right corner, in place.
+    The rendered text is cached per font size bucket (see watermark.py).
+    """
+    return stamp_watermark(img, text)
 
-def steg_process_image(image_bytes: bytes, *, mode: str = "matrix", watermark: bool = True) -> bytes:
+def steg_process_image(image_bytes: bytes, *, mode: str = "matrix", watermark: bool = True,
+                       seed: int | None = None) -> bytes:
     """
     Full stego-safe pipeline with user-selected visual effect:
     - Strip metadata
-    - Apply visual effect (matrix, glitch, pixel_sort)
+    - Apply visual effect (matrix, glitch, pixel_sort, pixel_sort_luma)
     - Optional watermark
-    - Return clean PNG bytes
+    - Return clean, losslessly encoded bytes (see image_encoder)
+    Images over the effect budget are downscaled while decoding (see ingest).
+    Deterministic runs are served from the result cache when possible.
     """
-    with Image.open(io.BytesIO(image_bytes)) as img:
-        img = img.convert("RGB")
+    # Unseeded shuffles differ every run, so they are never cached
+    cacheable = mode != "pixel_sort" or seed is not None
+    if cacheable:
+        key = cache.key(cache.digest(image_bytes), "steg_process_image", mode=mode,
+                        watermark=watermark, seed=seed, max_pixels=MAX_EFFECT_PIXELS,
+                        encoder=encoder_settings())
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
 
+    with open_for_effect(image_bytes) as img:
         if mode == "matrix":
             img = apply_matrix_style_effect(img)
         elif mode == "glitch":
             img = apply_glitch_effect(img)
         elif mode == "pixel_sort":
-            img = apply_pixel_sort_effect(img)
+            img = apply_pixel_sort_effect(img, seed=seed)
+        elif mode == "pixel_sort_luma":
+            img = apply_pixel_sort_effect(img, variant="sort")
 
         if watermark:
             img = watermark_image(img)
 
-        output = io.BytesIO()
-        img.save(output, format="PNG", optimize=True)
-        output.seek(0)
-        return output.read()
+        result = encode_image(img)[0]
+
+    if cacheable:
+        cache.put(key, result)
+    return result
 
 def scrub_image_metadata(image_bytes: bytes) -> bytes:
+    """
+    Removes EXIF, GPS, ICC and text metadata. PNG and JPEG uploads are handled
+    by chunk/segment surgery and keep their format and compression; anything
+    else is decoded and re-encoded.
+    """
+    stripped = strip_metadata(image_bytes)
+    if stripped is not None:
+        return stripped
+
     with Image.open(io.BytesIO(image_bytes)) as img:
         img = img.convert("RGB")
-        output = io.BytesIO()
-        img.save(output, format="PNG", optimize=True)
-        return output.getvalue()
+        return encode_image(img)[0]
 
 def sanitize_image(image_bytes: bytes, scramble_metadata: bool = False) -> bytes:
     with Image.open(io.BytesIO(image_bytes)) as img:
@@ -113,21 +203,17 @@ def sanitize_image(image_bytes: bytes, scramble_metadata: bool = False) -> bytes
         else:
             exif_bytes = None
 
-        output = io.BytesIO()
-        img.save(output, format="PNG", exif=exif_bytes, optimize=True)
-        return output.getvalue()
+        return encode_image(img, exif=exif_bytes)[0]
 
-def steg_scrub_and_mutate(image_bytes: bytes) -> bytes:
+def steg_scrub_and_mutate(image_bytes: bytes | RawFrame) -> bytes:
     """
     Full steganographic-safe pipeline:
     - Strips all metadata
     - Applies Matrix-style visual distortion
     - Adds watermark ("Encrypted by StegoBot")
-    - Outputs clean PNG bytes
+    - Outputs clean, losslessly encoded bytes
     """
-    with Image.open(io.BytesIO(image_bytes)) as img:
-        img = img.convert("RGB")
-
+    with open_for_effect(image_bytes) as img:
         # Apply Matrix effect
         img = apply_matrix_style_effect(img)
 
@@ -135,12 +221,283 @@ def steg_scrub_and_mutate(image_bytes: bytes) -> bytes:
         img = watermark_image(img)
 
         # Save scrubbed image with no metadata
-        output = io.BytesIO()
-        img.save(output, format="PNG", optimize=True)
-        output.seek(0)
-        return output.read()
+        return encode_image(img)[0]
+
+def matrixify_and_watermark(image_bytes: bytes | RawFrame) -> bytes:
+    """
+    Matrix effect + watermark, returned as encoded bytes ("Matrixify + Watermark" in the menu).
+    """
+    with open_for_effect(image_bytes) as img:
+        img = apply_matrix_style_effect(img)
+        img = watermark_image(img)
+        return encode_image(img)[0]
+
+# --- LSB engine -------------------------------------------------------------
+#
+# Bits are stored one per channel in the least significant bit, walking the
+# flattened RGB buffer in scan order (R, G, B of pixel 0, then pixel 1, ...).
+# The array engine below keeps that exact layout, so images written by the
+# original pixel-loop code decode unchanged.
+
+LSB_DECODE_CHUNK_BITS = 8 * 4096  # first read; doubles until the terminator shows up
+
+
+def _message_bits(message: str) -> np.ndarray:
+    """
+    Bit array for `message` followed by the null terminator.
+    """
+    try:
+        data = message.encode("latin-1")
+    except UnicodeEncodeError:
+        # Code points above 0xFF were always written with format(ord(c), '08b'),
+        # i.e. more than 8 bits; keep producing the same bit stream for them.
+        bitstring = ''.join(format(ord(c), '08b') for c in message) + '00000000'
+        return np.frombuffer(bitstring.encode("ascii"), dtype=np.uint8) - ord("0")
+    return np.unpackbits(np.frombuffer(data + b"\x00", dtype=np.uint8))
+
+
+def _channel_span(img: Image.Image, start: int, count: int) -> tuple[int, int, int]:
+    """
+    Rows covering flat channel indices [start, start + count), plus the offset
+    of `start` inside the first of those rows.
+    """
+    row_len = img.width * 3
+    first_row = start // row_len
+    last_row = min(img.height, -(-(start + count) // row_len))
+    return first_row, last_row, start - first_row * row_len
+
+
+def _read_lsb_bits(img: Image.Image, start: int, count: int, depth: int = 1) -> np.ndarray:
+    """
+    Low `depth` bits of `count` channels starting at flat channel index `start`,
+    as a flat bit array (most significant of each channel's bits first).
+    Only the rows that hold those channels are copied out of the image (and
+    converted to RGB, if it's in another mode).
+    """
+    first_row, last_row, offset = _channel_span(img, start, count)
+    rows = img.crop((0, first_row, img.width, last_row))
+    if rows.mode != "RGB":
+        rows = rows.convert("RGB")
+    region = np.asarray(rows, dtype=np.uint8)
+    values = region.reshape(-1)[offset:offset + count] & ((1 << depth) - 1)
+    if depth == 1:
+        return values
+    shifts = np.arange(depth - 1, -1, -1, dtype=np.uint8)
+    return ((values[:, None] >> shifts) & 1).reshape(-1)
 
-def lsb_encode(img: Image.Image, message: str) -> Image.Image:
+
+def _write_lsb_bits(img: Image.Image, bits: np.ndarray, start: int = 0, depth: int = 1) -> int:
+    """
+    Writes `bits` into the low `depth` bits of the channels starting at flat
+    channel index `start`. Returns how many bits fit; the rest are dropped.
+    """
+    if depth > 1:
+        # Group the bits per channel; the last group is zero padded
+        padded = np.zeros(-(-len(bits) // depth) * depth, dtype=np.uint8)
+        padded[:len(bits)] = bits
+        weights = (1 << np.arange(depth - 1, -1, -1)).astype(np.uint8)
+        values = (padded.reshape(-1, depth) * weights).sum(axis=1, dtype=np.uint8)
+    else:
+        values = bits
+
+    first_row, last_row, offset = _channel_span(img, start, len(values))
+    region = np.array(img.crop((0, first_row, img.width, last_row)), dtype=np.uint8)
+    flat = region.reshape(-1)
+    n = max(0, min(len(values), flat.size - offset))
+    keep = 0xFF ^ ((1 << depth) - 1)
+    flat[offset:offset + n] = (flat[offset:offset + n] & keep) | values[:n]
+    img.paste(Image.fromarray(region, "RGB"), (0, first_row))
+    return min(len(bits), n * depth)
+
+
+def lsb_encode(img: Image.Image, message: str, *, legacy: bool = False) -> Image.Image:
+    """
+    Hides `message` (null terminated) in the channel LSBs of an RGB image, in place.
+    Raises ValueError if it doesn't fit. Pass legacy=True to run the original
+    per-pixel loop instead of the array engine (which silently truncates).
+    """
+    if legacy:
+        return _lsb_encode_legacy(img, message)
+    if img.mode != "RGB":
+        raise ValueError("lsb_encode expects an RGB image")
+
+    bits = _message_bits(message)
+    if len(bits) > img.width * img.height * 3:
+        raise ValueError(
+            f"Message needs {len(bits)} bits but the image only holds {img.width * img.height * 3}."
+        )
+    _write_lsb_bits(img, bits)
+    return img
+
+
+def lsb_decode(img: Image.Image, *, legacy: bool = False) -> str:
+    """
+    Reads a null-terminated message from the channel LSBs.
+    Only reads as far as the terminator; pass legacy=True for the original full scan.
+    """
+    if legacy:
+        return _lsb_decode_legacy(img if img.mode == "RGB" else img.convert("RGB"))
+
+    total = img.width * img.height * 3
+    chunks = []
+    pos = 0
+    step = LSB_DECODE_CHUNK_BITS
+    while pos < total:
+        count = min(step, total - pos)
+        bits = _read_lsb_bits(img, pos, count)
+        whole = count - count % 8
+        data = np.packbits(bits[:whole]).tobytes()
+        end = data.find(b"\x00")
+        if end != -1:
+            chunks.append(data[:end])
+            return b''.join(chunks).decode("latin-1")
+        chunks.append(data)
+        if whole < count:
+            # No terminator at all: the original decoder kept the trailing partial byte
+            chunks.append(bytes([int(''.join(map(str, bits[whole:])), 2)]))
+        pos += count
+        step *= 2
+    return b''.join(chunks).decode("latin-1")
+
+
+# --- Payload container ------------------------------------------------------
+#
+# hide_message used to embed the ciphertext as a null-terminated hex string.
+# New carriers hold a small header followed by the raw bytes:
+#
+#   v1: magic (3 bytes) | version (1 byte) | payload length (4 bytes, big endian)
+#   v2: magic (3 bytes) | version (1 byte) | bit depth (1 byte) | payload length (4 bytes)
+#
+# The header is always stored at one bit per channel so readers can find it
+# without knowing the depth; v2 payloads then use the low 1-3 bits of each
+# channel. Depth 1 is still written as v1 so older readers keep working.
+#
+# The magic's first byte is not a hex digit, so it never collides with the
+# old format, and readers fall back to lsb_decode() when it's missing.
+
+STEG_MAGIC = b"\xa7SB"
+STEG_V1 = 1
+STEG_V2 = 2
+MAX_LSB_DEPTH = 3
+_STEG_PREFIX = struct.Struct(">3sB")
+_STEG_HEADER_V1 = struct.Struct(">3sBI")
+_STEG_HEADER_V2 = struct.Struct(">3sBBI")
+
+
+def _header_struct(depth: int) -> struct.Struct:
+    return _STEG_HEADER_V1 if depth == 1 else _STEG_HEADER_V2
+
+
+def plan_capacity(width: int, height: int, depth: int = 1) -> int:
+    """
+    Number of payload bytes a container can hold in a width x height image
+    at `depth` bits per channel. Needs only the dimensions, so uploads can be
+    checked before anything is decoded.
+    """
+    if not 1 <= depth <= MAX_LSB_DEPTH:
+        raise ValueError(f"Bit depth must be between 1 and {MAX_LSB_DEPTH}.")
+    channels = width * height * 3 - _header_struct(depth).size * 8
+    return max(0, channels * depth // 8)
+
+
+def plan_depth(width: int, height: int, payload_size: int, depth: int | None = None) -> int:
+    """
+    Bit depth to embed `payload_size` bytes with: `depth` if given, otherwise
+    the smallest one that fits. Raises ValueError if the payload can't fit.
+    """
+    depths = [depth] if depth else range(1, MAX_LSB_DEPTH + 1)
+    for d in depths:
+        if payload_size <= plan_capacity(width, height, d):
+            return d
+    best = depth or MAX_LSB_DEPTH
+    raise ValueError(
+        f"Payload is {payload_size} bytes but a {width}x{height} image only holds "
+        f"{plan_capacity(width, height, best)} at {best} bit{'s' if best > 1 else ''} per channel."
+    )
+
+
+def lsb_capacity(img: Image.Image, depth: int = 1) -> int:
+    """
+    Number of payload bytes a container can hold in this image.
+    """
+    return plan_capacity(img.width, img.height, depth)
+
+
+def lsb_embed_payload(img: Image.Image, payload: bytes, depth: int | None = None) -> Image.Image:
+    """
+    Writes `payload` as a versioned container into an RGB image, in place,
+    at `depth` bits per channel (default: the smallest that fits).
+    Raises ValueError if it doesn't fit.
+    """
+    if img.mode != "RGB":
+        raise ValueError("lsb_embed_payload expects an RGB image")
+    depth = plan_depth(img.width, img.height, len(payload), depth)
+
+    if depth == 1:
+        header = _STEG_HEADER_V1.pack(STEG_MAGIC, STEG_V1, len(payload))
+    else:
+        header = _STEG_HEADER_V2.pack(STEG_MAGIC, STEG_V2, depth, len(payload))
+    header_bits = np.unpackbits(np.frombuffer(header, dtype=np.uint8))
+    _write_lsb_bits(img, header_bits)
+    _write_lsb_bits(img, np.unpackbits(np.frombuffer(payload, dtype=np.uint8)), len(header_bits), depth)
+    return img
+
+
+def lsb_extract_payload(img: Image.Image) -> bytes | None:
+    """
+    Reads a container written by lsb_embed_payload().
+    Returns None when the image has no container header (e.g. old hex carriers),
+    and only touches the pixels that hold the header and payload.
+    """
+    channels = img.width * img.height * 3
+    if channels < _STEG_HEADER_V1.size * 8:
+        return None
+
+    prefix_bits = min(channels - channels % 8, _STEG_HEADER_V2.size * 8)
+    prefix = np.packbits(_read_lsb_bits(img, 0, prefix_bits)).tobytes()
+    magic, version = _STEG_PREFIX.unpack_from(prefix)
+    if magic != STEG_MAGIC:
+        return None
+    if version == STEG_V1:
+        _, _, length = _STEG_HEADER_V1.unpack_from(prefix)
+        depth = 1
+    elif version == STEG_V2 and len(prefix) >= _STEG_HEADER_V2.size:
+        _, _, depth, length = _STEG_HEADER_V2.unpack_from(prefix)
+        if not 1 < depth <= MAX_LSB_DEPTH:
+            raise ValueError("Hidden payload header is corrupt.")
+    else:
+        raise ValueError(f"Unsupported hidden payload version {version}.")
+    if length > lsb_capacity(img, depth):
+        raise ValueError("Hidden payload header is corrupt.")
+
+    start = _header_struct(depth).size * 8
+    bits = _read_lsb_bits(img, start, -(-length * 8 // depth), depth)
+    return np.packbits(bits[:length * 8]).tobytes()
+
+
+def hide_payload_in_image(image_bytes: bytes, payload: bytes, depth: int | None = None) -> bytes:
+    """
+    Embeds `payload` into the uploaded image and returns the carrier as PNG bytes.
+    """
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        img = lsb_embed_payload(img.convert("RGB"), payload, depth)
+        return encode_image(img, carrier=True)[0]
+
+
+def read_hidden_payload(image_bytes: bytes) -> tuple[bytes | None, str]:
+    """
+    Returns (container payload, legacy message) for an uploaded image.
+    The legacy null-terminated string is only decoded when there is no container.
+    Only the rows holding the header and payload are converted to RGB.
+    """
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        payload = lsb_extract_payload(img)
+        if payload is not None:
+            return payload, ""
+        return None, lsb_decode(img)
+
+
+def _lsb_encode_legacy(img: Image.Image, message: str) -> Image.Image:
     binary_message = ''.join(format(ord(c), '08b') for c in message) + '00000000'  # Null terminator
     pixels = img.load()
     width, height = img.size
@@ -166,8 +523,7 @@ def lsb_encode(img: Image.Image, message: str) -> Image.Image:
     return img
 
 
-
-def lsb_decode(img: Image.Image) -> str:
+def _lsb_decode_legacy(img: Image.Image) -> str:
     pixels = img.load()
     width, height = img.size
     bits = []
@@ -0,0 +1,149 @@
+import asyncio
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Memory all pending /steg_image menus may hold between them
+STEG_VIEW_MEMORY_BYTES = int(os.getenv("STEG_VIEW_MEMORY_BYTES", str(256 * 1024 * 1024)))
+
+
+class ViewState:
+    """
+    The upload behind one pending StegImageMenu, plus its decoded frame once
+    an effect needed it. Created by ViewStateStore.create(); call release()
+    when the menu is finished with it.
+    """
+
+    def __init__(self, store: "ViewStateStore", image_bytes: bytes):
+        self._store = store
+        self._data = image_bytes
+        self._path = None
+        self._spilling = False
+        self.size = len(image_bytes)
+        self.frame = None
+        self.digest = None
+        self.released = False
+
+    async def image_bytes(self) -> bytes:
+        """
+        The original upload, read back from the spill directory if it was spilled.
+        """
+        if self.released:
+            raise RuntimeError("This menu has expired. Run /steg_image again.")
+        self._store._touch(self)
+        if self._data is not None:
+            return self._data
+
+        def read(path):
+            with open(path, "rb") as f:
+                return f.read()
+        return await asyncio.to_thread(read, self._path)
+
+    async def get_frame(self, decode):
+        """
+        The decoded frame, decoding it once with `decode(image_bytes)` on first use.
+        """
+        self._store._touch(self)
+        if self.frame is None:
+            frame = await decode(await self.image_bytes())
+            if self.released or self.frame is not None:
+                return frame
+            self.frame = frame
+            await self._store._charge(frame.nbytes)
+            return frame
+        return self.frame
+
+    def release(self):
+        self._store._release(self)
+
+
+class ViewStateStore:
+    """
+    Holds pending menu uploads under one global memory budget. When the
+    budget is exceeded, decoded frames of the least recently used menus are
+    dropped first (they can be decoded again), then their uploads are spilled
+    to a temporary directory.
+    """
+
+    def __init__(self, budget: int = STEG_VIEW_MEMORY_BYTES):
+        self.budget = budget
+        self.used = 0
+        self._states = OrderedDict()
+        self._spill_dir = None
+
+    async def create(self, image_bytes: bytes) -> ViewState:
+        state = ViewState(self, image_bytes)
+        self._states[id(state)] = state
+        await self._charge(state.size)
+        return state
+
+    def _touch(self, state: ViewState):
+        if id(state) in self._states:
+            self._states.move_to_end(id(state))
+
+    async def _charge(self, nbytes: int):
+        self.used += nbytes
+        for state in list(self._states.values()):
+            if self.used <= self.budget:
+                return
+            if state.frame is not None:
+                self.used -= state.frame.nbytes
+                state.frame = None
+
+        for state in list(self._states.values()):
+            if self.used <= self.budget:
+                return
+            if state._data is not None and not state._spilling:
+                await self._spill(state)
+
+    async def _spill(self, state: ViewState):
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix="stegbot-views-")
+
+        state._spilling = True
+
+        def write(data):
+            fd, path = tempfile.mkstemp(dir=self._spill_dir)
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            return path
+
+        path = await asyncio.to_thread(write, state._data)
+        if state.released:
+            os.remove(path)
+            return
+        # Readers keep using the in-memory copy until the file is complete
+        state._path = path
+        state._data = None
+        self.used -= state.size
+
+    def _release(self, state: ViewState):
+        if state.released:
+            return
+        state.released = True
+        self._states.pop(id(state), None)
+        if state._data is not None:
+            self.used -= state.size
+        if state.frame is not None:
+            self.used -= state.frame.nbytes
+        state._data = state.frame = None
+        if state._path is not None:
+            try:
+                os.remove(state._path)
+            except OSError:
+                pass
+
+    def close(self):
+        for state in list(self._states.values()):
+            state.release()
+        if self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
+
+
+view_states = ViewStateStore()
@@ -0,0 +1,69 @@
+import os
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+
+# Resolved next to this file so the bot can be started from any directory
+FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "DejaVuSans.ttf")
+WATERMARK_TEXT = "Encrypted by StegoBot"
+WATERMARK_COLOR = (0, 255, 0)  # Matrix green
+WATERMARK_MARGIN = (12, 8)  # from the right and bottom edges
+
+# Font size is 3% of the image width, rounded down to a multiple of
+# FONT_SIZE_STEP so nearby widths share one cached stamp
+MIN_FONT_SIZE = 12
+FONT_SIZE_STEP = 4
+# Common upload widths, pre-rendered when the worker processes start
+WARM_WIDTHS = (640, 800, 1024, 1080, 1280, 1600, 1920, 2048, 2560, 3024, 3840, 4032)
+
+
+def font_size_bucket(width: int) -> int:
+    size = max(MIN_FONT_SIZE, int(width * 0.03))
+    return size - (size - MIN_FONT_SIZE) % FONT_SIZE_STEP
+
+
+@lru_cache(maxsize=32)
+def load_font(size: int):
+    try:
+        return ImageFont.truetype(FONT_PATH, size)
+    except IOError:
+        return ImageFont.load_default()
+
+
+@lru_cache(maxsize=128)
+def render_stamp(text: str, size: int) -> tuple[Image.Image, tuple[int, int, int, int]]:
+    """
+    The text rendered once as an RGBA stamp cropped to its ink, plus the
+    text's bounding box as ImageDraw.textbbox() reports it at the origin.
+    """
+    font = load_font(size)
+    bbox = ImageDraw.Draw(Image.new("L", (1, 1))).textbbox((0, 0), text, font=font)
+    left, top, right, bottom = bbox
+
+    mask = Image.new("L", (max(1, right - left), max(1, bottom - top)), 0)
+    ImageDraw.Draw(mask).text((-left, -top), text, font=font, fill=255)
+    stamp = Image.new("RGBA", mask.size, WATERMARK_COLOR + (0,))
+    stamp.putalpha(mask)
+    return stamp, bbox
+
+
+def stamp_watermark(img: Image.Image, text: str = WATERMARK_TEXT) -> Image.Image:
+    """
+    Pastes the cached stamp into the bottom-right corner of `img`, in place.
+    """
+    stamp, (left, top, right, bottom) = render_stamp(text, font_size_bucket(img.width))
+    # Same placement as drawing the text at (width - text width - margin, ...)
+    x = img.width - (right - left) - WATERMARK_MARGIN[0]
+    y = img.height - (bottom - top) - WATERMARK_MARGIN[1]
+    img.paste(stamp, (x + left, y + top), stamp)
+    return img
+
+
+def warm_watermark_cache(widths=WARM_WIDTHS, text: str = WATERMARK_TEXT):
+    """
+    Loads the font and renders the stamp for common image widths, so the
+    first watermark a worker draws doesn't pay for it. Used as the worker
+    pool initializer.
+    """
+    for width in widths:
+        render_stamp(text, font_size_bucket(width))
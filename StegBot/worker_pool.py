@@ -0,0 +1,103 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Number of worker processes for image work (defaults to one per core)
+STEG_WORKERS = int(os.getenv("STEG_WORKERS") or os.cpu_count() or 2)
+# Seconds a single task may take before the caller gives up on it
+STEG_TASK_TIMEOUT = float(os.getenv("STEG_TASK_TIMEOUT", "60"))
+
+
+class TaskTimeout(Exception):
+    """The task didn't finish within its timeout or before the interaction expired."""
+
+
+def _run_task(deadline, func, args, kwargs):
+    # Tasks that sat in the queue past their deadline are dropped instead of run
+    if deadline is not None and time.time() >= deadline:
+        raise TaskTimeout("Task expired before a worker picked it up.")
+    return func(*args, **kwargs)
+
+
+class WorkerPool:
+    """
+    Runs CPU-heavy steg_helpers functions in a ProcessPoolExecutor so the
+    event loop (and the gateway heartbeat) never blocks on image work.
+    Functions and their arguments must be picklable, so tasks pass bytes in
+    and get bytes out.
+    """
+
+    def __init__(self, workers: int = STEG_WORKERS, timeout: float = STEG_TASK_TIMEOUT):
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.initializer = None
+        self._executor = None
+
+    def start(self, initializer=None):
+        """
+        Starts the worker processes. Call this before the bot connects so the
+        workers are forked from a process that isn't running any threads yet.
+        `initializer` runs once in every worker (including replacements after
+        a crash), e.g. to warm per-process caches.
+        """
+        if initializer is not None:
+            self.initializer = initializer
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=self.initializer)
+            self._executor.submit(int).result()
+        return self
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, func, *args, timeout: float | None = None, deadline: float | None = None, **kwargs):
+        """
+        Runs func(*args, **kwargs) in a worker and returns its result.
+
+        `timeout` defaults to the pool's timeout; `deadline` is a Unix timestamp
+        (e.g. when the interaction expires) after which the result is useless.
+        If the caller is cancelled or times out, a task that hasn't started yet
+        is cancelled. A task that is already running finishes in the background
+        and its result is discarded.
+        """
+        self.start()
+        timeout = self.timeout if timeout is None else timeout
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.time())
+            if timeout <= 0:
+                raise TaskTimeout("Interaction expired before the task started.")
+
+        loop = asyncio.get_running_loop()
+        try:
+            future = loop.run_in_executor(self._executor, _run_task, deadline, func, args, kwargs)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); replace the pool and retry once
+            self.shutdown()
+            self.start()
+            future = loop.run_in_executor(self._executor, _run_task, deadline, func, args, kwargs)
+
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise TaskTimeout(f"Task took longer than {timeout:g}s.") from None
+        except BrokenProcessPool:
+            self.shutdown()
+            raise
+
+
+pool = WorkerPool()
+
+
+def interaction_deadline(interaction) -> float:
+    """
+    Unix timestamp after which followups for this interaction can no longer be sent.
+    """
+    return interaction.expires_at.timestamp()
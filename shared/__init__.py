@@ -0,0 +1,4 @@
+"""
+Modules used by both StegBot and CryptoCompanion. Each bot puts the repository
+root on sys.path and loads its .env before importing them.
+"""
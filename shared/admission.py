@@ -0,0 +1,281 @@
+import asyncio
+import functools
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+import discord
+
+# Heavy commands running at once across all users
+SCHED_CONCURRENCY = int(os.getenv("SCHED_CONCURRENCY") or os.cpu_count() or 2)
+# Heavy commands waiting at once across all users; more are turned away
+SCHED_QUEUE_LIMIT = int(os.getenv("SCHED_QUEUE_LIMIT", "50"))
+# Heavy commands one user may have running / waiting at once
+SCHED_USER_CONCURRENCY = int(os.getenv("SCHED_USER_CONCURRENCY", "1"))
+SCHED_USER_QUEUE = int(os.getenv("SCHED_USER_QUEUE", "3"))
+# Token bucket per user: heavy commands per second sustained, and how many may come in a burst
+SCHED_USER_RATE = float(os.getenv("SCHED_USER_RATE", "0.2"))
+SCHED_USER_BURST = float(os.getenv("SCHED_USER_BURST", "5"))
+# Requests whose estimated wait is longer than this many seconds are turned away up front
+SCHED_LATENCY_BUDGET = float(os.getenv("SCHED_LATENCY_BUDGET", "30"))
+
+# Weight of the newest run in the average run time used to estimate waits
+_SERVICE_SMOOTHING = 0.2
+
+
+class Rejected(Exception):
+    """The request was turned away before running; str(e) says why, for the user."""
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """
+        Takes a token and returns 0, or returns the seconds until one is available.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def full(self) -> bool:
+        return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.burst
+
+
+class Scheduler:
+    """
+    Admission control for CPU-heavy commands, on the event loop.
+
+    Each user is rate limited by a token bucket and may run at most
+    `user_concurrency` heavy commands at once. Beyond `concurrency` running
+    commands, requests wait in per-user queues served round-robin, so one
+    user's pile of requests can't hold everyone else up. A request is turned
+    away (Rejected) as soon as it arrives if its queue is full or its
+    estimated wait exceeds the latency budget, rather than timing out later.
+    """
+
+    def __init__(self, concurrency: int = SCHED_CONCURRENCY, queue_limit: int = SCHED_QUEUE_LIMIT,
+                 user_concurrency: int = SCHED_USER_CONCURRENCY, user_queue: int = SCHED_USER_QUEUE,
+                 user_rate: float = SCHED_USER_RATE, user_burst: float = SCHED_USER_BURST,
+                 latency_budget: float = SCHED_LATENCY_BUDGET):
+        self.concurrency = max(1, concurrency)
+        self.queue_limit = queue_limit
+        self.user_concurrency = max(1, user_concurrency)
+        self.user_queue = user_queue
+        self.user_rate = user_rate
+        self.user_burst = max(1.0, user_burst)
+        self.latency_budget = latency_budget
+        self.service_seconds = 1.0  # running average of how long a heavy command takes
+        self._running = 0
+        self._user_running = {}
+        self._queues = OrderedDict()  # user_id -> deque of (future, deadline), in round-robin order
+        self._queued = 0
+        self._buckets = {}
+        self.admitted = self.queued = self.rate_limited = self.shed = 0
+
+    def _take_token(self, user_id: int):
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) > 10_000:
+                # Users who have been idle long enough to be back at a full bucket
+                self._buckets = {uid: b for uid, b in self._buckets.items() if not b.full()}
+            bucket = self._buckets[user_id] = TokenBucket(self.user_rate, self.user_burst)
+        wait = bucket.take()
+        if wait:
+            self.rate_limited += 1
+            raise Rejected(f"⏳ You're sending these too fast; try again in {wait:.0f}s.")
+
+    def _ahead_of(self, user_id: int) -> int:
+        """
+        How many queued requests would be served before a new one from `user_id`.
+        """
+        own = self._queues.get(user_id)
+        rounds = len(own) if own else 0
+        ahead = rounds
+        before = True  # users before this one in the rotation get one more turn first
+        for uid, queue in self._queues.items():
+            if uid == user_id:
+                before = False
+                continue
+            ahead += min(len(queue), rounds + 1 if before or own is None else rounds)
+        return ahead
+
+    def estimated_wait(self, ahead: int) -> float:
+        return (ahead // self.concurrency + 1) * self.service_seconds
+
+    def _start(self, user_id: int):
+        self._running += 1
+        self._user_running[user_id] = self._user_running.get(user_id, 0) + 1
+        self.admitted += 1
+
+    def _finish(self, user_id: int, elapsed: float | None):
+        self._running -= 1
+        self._user_running[user_id] -= 1
+        if not self._user_running[user_id]:
+            del self._user_running[user_id]
+        if elapsed is not None:
+            self.service_seconds += _SERVICE_SMOOTHING * (elapsed - self.service_seconds)
+        self._dispatch()
+
+    def _dispatch(self):
+        """
+        Hands free slots to queued requests, one user at a time in rotation.
+        """
+        while self._running < self.concurrency:
+            for user_id, queue in self._queues.items():
+                if self._user_running.get(user_id, 0) < self.user_concurrency:
+                    break
+            else:
+                return  # everyone waiting is at their own limit
+
+            future, deadline = queue.popleft()
+            self._queued -= 1
+            if queue:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            if future.done():
+                continue  # the caller gave up
+            if deadline is not None and time.time() >= deadline:
+                future.set_exception(Rejected("⌛ This request expired while it was queued."))
+                continue
+            self._start(user_id)
+            future.set_result(None)
+
+    def _remove(self, user_id: int, future):
+        queue = self._queues.get(user_id)
+        for i, (waiting, _) in enumerate(queue or ()):
+            if waiting is future:
+                del queue[i]
+                self._queued -= 1
+                if not queue:
+                    del self._queues[user_id]
+                return
+
+    @asynccontextmanager
+    async def slot(self, user_id: int, deadline: float | None = None, on_queued=None):
+        """
+        Holds one of the heavy-command slots for `user_id` while the block runs.
+        Raises Rejected if the request is turned away. `deadline` is a Unix
+        timestamp after which the request is useless; if the request has to
+        wait, `await on_queued(position, estimated seconds)` is called first.
+        """
+        self._take_token(user_id)
+
+        if self._running < self.concurrency and self._user_running.get(user_id, 0) < self.user_concurrency:
+            self._start(user_id)
+        else:
+            queue = self._queues.get(user_id)
+            if queue and len(queue) >= self.user_queue:
+                raise Rejected(f"⏳ You already have {len(queue)} requests waiting; let those finish first.")
+            ahead = self._ahead_of(user_id)
+            wait = self.estimated_wait(ahead)
+            budget = self.latency_budget if deadline is None else min(self.latency_budget, deadline - time.time())
+            if self._queued >= self.queue_limit or wait > budget:
+                self.shed += 1
+                raise Rejected(f"🚦 The bot is busy right now (about {wait:.0f}s wait); please try again shortly.")
+
+            future = asyncio.get_running_loop().create_future()
+            self._queues.setdefault(user_id, deque()).append((future, deadline))
+            self._queued += 1
+            self.queued += 1
+            try:
+                if on_queued is not None:
+                    try:
+                        await on_queued(ahead + 1, wait)
+                    except Exception:
+                        pass  # feedback is best-effort
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled() and future.exception() is None:
+                    self._finish(user_id, None)  # a slot was handed over just as the caller gave up
+                else:
+                    future.cancel()
+                    self._remove(user_id, future)
+                raise
+
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._finish(user_id, time.monotonic() - start)
+
+    @asynccontextmanager
+    async def admit(self, interaction: discord.Interaction):
+        """
+        slot() for an interaction that has been deferred: its queue position
+        is shown in the deferred response while it waits.
+        """
+        queued = False
+
+        async def on_queued(position: int, wait: float):
+            nonlocal queued
+            queued = True
+            await interaction.edit_original_response(
+                content=f"⏳ Queued: you're number {position} in line (about {wait:.0f}s)."
+            )
+
+        async with self.slot(interaction.user.id, interaction.expires_at.timestamp(), on_queued):
+            if queued:
+                try:
+                    await interaction.edit_original_response(content="⚙️ Your turn; working on it…")
+                except discord.HTTPException:
+                    pass
+            yield
+
+    def stats(self) -> dict:
+        return {
+            "running": self._running,
+            "queued_now": self._queued,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rate_limited": self.rate_limited,
+            "shed": self.shed,
+            "service_seconds": round(self.service_seconds, 3),
+        }
+
+
+scheduler = Scheduler()
+
+
+def admission_controlled(func=None, *, precheck=None):
+    """
+    For heavy command (or component) callbacks: defers the interaction
+    (ephemeral, thinking) and runs the callback in a scheduler slot, or
+    tells the user why it was turned away. The callback must not defer
+    again; it replies with followups.
+
+    `precheck`, if given, is called with the callback's arguments first and
+    may return an error message to reply with instead, so requests that are
+    bound to fail don't use a rate-limit token or wait for a slot.
+    """
+    if func is None:
+        return functools.partial(admission_controlled, precheck=precheck)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        interaction = next(arg for arg in args if isinstance(arg, discord.Interaction))
+        if precheck is not None:
+            error = precheck(*args, **kwargs)
+            if error:
+                await interaction.response.send_message(error, ephemeral=True)
+                return
+        await interaction.response.defer(thinking=True, ephemeral=True)
+        try:
+            async with scheduler.admit(interaction):
+                return await func(*args, **kwargs)
+        except Rejected as e:
+            try:
+                await interaction.followup.send(str(e), ephemeral=True)
+            except discord.HTTPException:
+                pass  # the interaction expired while it was queued
+    return wrapper
@@ -0,0 +1,150 @@
+import base64
+import io
+import os
+import re
+import zlib
+from typing import NamedTuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # zlib only
+
+# Compression applied before encrypting: auto (zstd if installed, else zlib), zstd, zlib or none
+TRANSPORT_COMPRESSION = os.getenv("TRANSPORT_COMPRESSION", "auto").lower()
+# Text armor for ciphertext in messages: z85 (smallest) or base64url
+TRANSPORT_ARMOR = os.getenv("TRANSPORT_ARMOR", "z85").lower()
+# Armored ciphertext longer than this many characters is sent as a file instead
+TRANSPORT_INLINE_LIMIT = int(os.getenv("TRANSPORT_INLINE_LIMIT", "1800"))
+# Largest message a compressed payload may expand to
+TRANSPORT_MAX_MESSAGE = int(os.getenv("TRANSPORT_MAX_MESSAGE", str(1024 * 1024)))
+
+# Ciphertext in text form:
+#
+#   "~" | version | armor (z = z85, b = base64url) | codec (n = none, d = deflate, s = zstd) | armored ciphertext
+#
+# and as a file attachment: b"SCT" | version | codec | raw ciphertext.
+# The codec says how the plaintext was compressed before it was encrypted.
+# Anything else is taken to be hex (or raw bytes) from before this format.
+TRANSPORT_VERSION = "1"
+TEXT_PREFIX = "~" + TRANSPORT_VERSION
+FILE_MAGIC = b"SCT" + TRANSPORT_VERSION.encode()
+# Sent as a file: `.bin` like encrypted files, and decrypting names the result message.txt
+MESSAGE_FILENAME = "encrypted_message.txt.bin"
+
+CODEC_NONE, CODEC_DEFLATE, CODEC_ZSTD = "n", "d", "s"
+
+# Z85 is base85 with an alphabet that has no quotes, backslash or backtick, so
+# it survives code blocks; it's the same encoding as base64.b85encode otherwise
+_B85_ALPHABET = b"0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz!#$%&()*+-;<=>?@^_`{|}~"
+_Z85_ALPHABET = b"0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ.-:+=^!/*?&<>()[]{}@%$#"
+_TO_Z85 = bytes.maketrans(_B85_ALPHABET, _Z85_ALPHABET)
+_FROM_Z85 = bytes.maketrans(_Z85_ALPHABET, _B85_ALPHABET)
+
+_HEX = re.compile(r"(?:[0-9a-fA-F]{2})+")
+
+
+class Packed(NamedTuple):
+    codec: str          # how the plaintext was compressed
+    ciphertext: bytes
+
+    def text(self, armor: str = TRANSPORT_ARMOR) -> str:
+        if armor == "base64url":
+            return f"{TEXT_PREFIX}b{self.codec}" + base64.urlsafe_b64encode(self.ciphertext).rstrip(b"=").decode()
+        return f"{TEXT_PREFIX}z{self.codec}" + base64.b85encode(self.ciphertext).translate(_TO_Z85).decode()
+
+    def file_bytes(self) -> bytes:
+        return FILE_MAGIC + self.codec.encode() + self.ciphertext
+
+    def fits_inline(self) -> bool:
+        return len(self.text()) <= TRANSPORT_INLINE_LIMIT
+
+
+def compress(message: bytes, method: str = TRANSPORT_COMPRESSION) -> tuple[str, bytes]:
+    """
+    (codec, data): `message` compressed with `method`, or as-is when that
+    doesn't make it smaller.
+    """
+    if method == "auto":
+        method = "zstd" if zstandard else "zlib"
+    if method == "zstd" and zstandard:
+        codec, data = CODEC_ZSTD, zstandard.ZstdCompressor(level=19).compress(message)
+    elif method in ("zstd", "zlib"):
+        deflate = zlib.compressobj(9, zlib.DEFLATED, -15)  # raw deflate: no header or checksum to pay for
+        codec, data = CODEC_DEFLATE, deflate.compress(message) + deflate.flush()
+    else:
+        return CODEC_NONE, message
+    return (codec, data) if len(data) < len(message) else (CODEC_NONE, message)
+
+
+def decompress(codec: str, data: bytes, limit: int = TRANSPORT_MAX_MESSAGE) -> bytes:
+    """
+    Reverses compress(). Raises ValueError for an unknown codec or output
+    over `limit` bytes.
+    """
+    if codec == CODEC_NONE:
+        return data
+    if codec == CODEC_DEFLATE:
+        inflate = zlib.decompressobj(-15)
+        message = inflate.decompress(data, limit + 1)
+    elif codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise ValueError("This message is zstd-compressed; install the zstandard package to read it.")
+        message = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)).read(limit + 1)
+    else:
+        raise ValueError(f"Unknown compression '{codec}'.")
+    if len(message) > limit:
+        raise ValueError("The decompressed message is too large.")
+    return message
+
+
+def seal(message: bytes, encrypt) -> Packed:
+    """
+    Compresses `message` and encrypts it with `encrypt` (bytes -> bytes).
+    """
+    codec, data = compress(message)
+    return Packed(codec, encrypt(data))
+
+
+def parse(data: str | bytes) -> Packed:
+    """
+    Packed from armored text, a file attachment's bytes, or hex / raw
+    ciphertext from before this format. Raises ValueError for text that
+    is none of those.
+    """
+    if isinstance(data, bytes):
+        if data.startswith(FILE_MAGIC) and len(data) > len(FILE_MAGIC):
+            return Packed(chr(data[len(FILE_MAGIC)]), data[len(FILE_MAGIC) + 1:])
+        try:
+            text = data.decode("ascii")
+        except UnicodeDecodeError:
+            return Packed(CODEC_NONE, data)  # raw ciphertext
+        try:
+            return parse(text)
+        except ValueError:
+            return Packed(CODEC_NONE, data)
+
+    # Pasted text may keep the code block and wrap lines; the armors have no whitespace or backticks
+    text = re.sub(r"[\s`]", "", data)
+    if text.startswith(TEXT_PREFIX) and len(text) >= len(TEXT_PREFIX) + 2:
+        armor, codec, body = text[len(TEXT_PREFIX)], text[len(TEXT_PREFIX) + 1], text[len(TEXT_PREFIX) + 2:]
+        try:
+            if armor == "z":
+                return Packed(codec, base64.b85decode(body.encode().translate(_FROM_Z85)))
+            if armor == "b":
+                return Packed(codec, base64.urlsafe_b64decode(body + "=" * (-len(body) % 4)))
+        except (ValueError, TypeError):
+            raise ValueError("The encrypted message is damaged.") from None
+        raise ValueError(f"Unknown armor '{armor}'.")
+    if _HEX.fullmatch(text):
+        return Packed(CODEC_NONE, bytes.fromhex(text))
+    raise ValueError("That doesn't look like an encrypted message.")
+
+
+def open_packed(data: str | bytes, decrypt) -> bytes:
+    """
+    The message in `data` (anything parse() accepts), decrypted with
+    `decrypt` (bytes -> bytes) and decompressed.
+    """
+    packed = parse(data)
+    return decompress(packed.codec, decrypt(packed.ciphertext))